@@ -5,25 +5,26 @@ from utils import *
 
 import matplotlib.pyplot as plt
 
-estimated_buildings_height_folder = "output//estimated_building_height//"
+# Results computed before the dataset existed are imported once
+import_existing_building_heights()
 
-all_files, filenames_without_extension = list_files_in_directory(estimated_buildings_height_folder)
+# Neighborhoods in the partitioned building height dataset
+filenames_without_extension = list_dataset_neighborhoods()
 
 real_buildings_height_folder = "data//boundary_building//"
 
-for i in range(len(all_files)):
-    # print(all_files[i], filenames_without_extension[i])
+for i in range(len(filenames_without_extension)):
+    # print(filenames_without_extension[i])
 
     # read real building height value
-    real_buildings_height_path = real_buildings_height_folder + all_files[i][:-5] + "_vector.shp"
+    real_buildings_height_path = real_buildings_height_folder + filenames_without_extension[i] + "_vector.shp"
     real_buildings_height_gdf = gpd.read_file(real_buildings_height_path)
     # print('columns: ', real_buildings_height_gdf.columns)
 
     real_buildings_height_gdf["ground truth bh value"] = real_buildings_height_gdf["dd_h_dak_m"] - real_buildings_height_gdf["h_maaiveld"] 
 
-    # read estimated building height value
-    estimated_buildings_height_path = estimated_buildings_height_folder + all_files[i]
-    estimated_buildings_height_gdf = gpd.read_file(estimated_buildings_height_path)
+    # read estimated building height value (only this neighborhood's partitions and its height column)
+    estimated_buildings_height_gdf = read_building_heights(columns=["MeanValue"], neighborhoods=[filenames_without_extension[i]])
 
     # check the nan value
     # print("nan value: ", "clipped_buildings_gdf nan: ", \
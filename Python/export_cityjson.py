@@ -0,0 +1,30 @@
+import argparse
+import os
+
+from utils import *
+
+"""
+Export the estimated building heights as LoD1 block models in CityJSONSeq
+(one CityJSONFeature per line), streamed chunk by chunk. The solids stand on the
+gap-filled DTM of their neighborhood (z in NAP metres) unless --relative is given.
+
+    python Python/export_cityjson.py
+    python Python/export_cityjson.py --names Binnenstad Tarthorst --output output/cityjson/wageningen.city.jsonl
+"""
+
+parser = argparse.ArgumentParser(description="Streaming CityJSONSeq LoD1 export")
+parser.add_argument("--names", nargs="+", default=None, help="neighborhoods to export (default: all estimated neighborhoods)")
+parser.add_argument("--output", default="output/cityjson/buildings.city.jsonl", help="CityJSONSeq file to write")
+parser.add_argument("--chunk-size", type=int, default=1000, help="buildings read and written at a time")
+parser.add_argument("--relative", action="store_true",
+                    help="write heights above ground (floors at z = 0) instead of standing the solids on the DTM in NAP heights")
+args = parser.parse_args()
+
+estimated_buildings_height_folder = "output/estimated_building_height"
+if args.names is None:
+    _, names = list_files_in_directory(estimated_buildings_height_folder)
+else:
+    names = args.names
+
+paths = [os.path.join(estimated_buildings_height_folder, f"{name}.json") for name in sorted(names)]
+export_cityjsonseq(paths, args.output, chunk_size=args.chunk_size, ground=not args.relative)
@@ -0,0 +1,117 @@
+import argparse
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from utils import *
+
+"""
+Local building height query service on top of output/estimated_building_height/.
+
+    python Python/height_service.py --port 8000
+
+    GET  /height?points=5.6634,51.9688;5.6650,51.9700
+    GET  /buildings?bbox=5.660,51.965,5.668,51.970&geometry=1
+    POST /height     {"points": [[5.6634, 51.9688], [5.6650, 51.9700]]}
+    POST /buildings  {"bboxes": [[5.660, 51.965, 5.668, 51.970]], "geometry": false}
+
+Coordinates are lon/lat (EPSG:4326). New or changed neighborhood outputs are picked up
+every --reload seconds.
+"""
+
+
+def reload_loop(index, interval, stop_event):
+    while not stop_event.wait(interval):
+        try:
+            index.refresh()
+        except Exception as e:
+            # Keep reloading; the next round may find the outputs complete again
+            print(f"Reloading the building height index failed: {e}")
+
+
+def parse_coordinates(values, arity):
+    # Turn [[x, y, ...], ...] into tuples of `arity` floats; raises ValueError on anything else
+    if not isinstance(values, (list, tuple)):
+        raise ValueError("expected a list of coordinate tuples")
+    coordinates = []
+    for value in values:
+        if not isinstance(value, (list, tuple)) or len(value) != arity:
+            raise ValueError(f"every coordinate tuple must have {arity} numbers")
+        if any(isinstance(number, bool) or not isinstance(number, (int, float, str)) for number in value):
+            raise ValueError("coordinates must be numbers")
+        coordinates.append(tuple(float(number) for number in value))
+    return coordinates
+
+
+class HeightRequestHandler(BaseHTTPRequestHandler):
+    index = None
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _answer(self, path, points=None, bboxes=None, with_geometry=False):
+        if path == "/height" and points is not None:
+            lons = [point[0] for point in points]
+            lats = [point[1] for point in points]
+            self._send_json(200, {"results": self.index.query_points(lons, lats)})
+        elif path == "/buildings" and bboxes is not None:
+            self._send_json(200, {"results": self.index.query_bboxes(bboxes, with_geometry)})
+        else:
+            self._send_json(404, {"error": "use /height with points or /buildings with bbox"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            points = parse_coordinates([point.split(",") for point in query["points"][0].split(";")], 2) if "points" in query else None
+            bboxes = parse_coordinates([bbox.split(",") for bbox in query["bbox"][0].split(";")], 4) if "bbox" in query else None
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._answer(url.path, points, bboxes, query.get("geometry", ["0"])[0] == "1")
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            self._send_json(400, {"error": "body must be JSON"})
+            return
+        if not isinstance(request, dict):
+            self._send_json(400, {"error": "body must be a JSON object"})
+            return
+        try:
+            points = parse_coordinates(request["points"], 2) if request.get("points") is not None else None
+            bboxes = parse_coordinates(request["bboxes"], 4) if request.get("bboxes") is not None else None
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._answer(urlparse(self.path).path, points, bboxes, bool(request.get("geometry", False)))
+
+    def log_message(self, format, *args):
+        pass  # Keep the console quiet at high request rates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Building height query service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--reload", type=float, default=30, help="seconds between checks for new outputs")
+    args = parser.parse_args()
+
+    HeightRequestHandler.index = BuildingHeightIndex()
+    stop_event = threading.Event()
+    threading.Thread(target=reload_loop, args=(HeightRequestHandler.index, args.reload, stop_event), daemon=True).start()
+
+    server = ThreadingHTTPServer((args.host, args.port), HeightRequestHandler)
+    print(f"Serving {len(HeightRequestHandler.index)} buildings on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        stop_event.set()
+        server.server_close()
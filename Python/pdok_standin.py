@@ -0,0 +1,36 @@
+import argparse
+import time
+
+from utils.pdok_standin import PDOKStandIn
+
+"""
+Offline stand-in for the PDOK WFS, WCS and download endpoints, for testing and
+benchmarking the download stage without network access.
+
+    python Python/pdok_standin.py --port 8010 --latency 0.2 --bandwidth 2000000 --error-rate 0.05 --truncate-rate 0.02
+
+Then, in another shell, export the printed variables and run the pipeline as usual.
+"""
+
+parser = argparse.ArgumentParser(description="Offline PDOK stand-in server")
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=8010)
+parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response")
+parser.add_argument("--bandwidth", type=float, default=None, help="throughput cap per response in bytes per second")
+parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with HTTP 503")
+parser.add_argument("--truncate-rate", type=float, default=0.0, help="share of responses cut off halfway")
+parser.add_argument("--seed", type=int, default=None, help="seed for reproducible fault injection")
+args = parser.parse_args()
+
+standin = PDOKStandIn(args.host, args.port, args.latency, args.bandwidth, args.error_rate, args.truncate_rate, args.seed).start()
+
+print("PDOK stand-in running. Point the pipeline at it with:")
+for key, value in standin.environment().items():
+    print(f"export {key}={value}")
+
+try:
+    while True:
+        time.sleep(10)
+        print(f"stats: {standin.stats}")
+except KeyboardInterrupt:
+    standin.stop()
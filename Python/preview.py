@@ -0,0 +1,36 @@
+import argparse
+import os
+
+import geopandas as gpd
+
+from utils import *
+from utils.maps import create_height_maps
+
+"""
+Quick look at a municipality: approximate building heights on a coarse grid, with an
+estimated error bound per building, and the vis.py maps of the result.
+
+    python Python/preview.py --municipality Wageningen
+    python Python/preview.py --municipality Wageningen --neighborhoods Binnenstad --resolution 5
+
+The clipped footprints, kaartblad sheets and store tiles of a preview are reused by a later
+full-resolution run of the same neighborhoods.
+"""
+
+parser = argparse.ArgumentParser(description="Fast building height preview")
+parser.add_argument("--municipality", required=True, help="municipality name (case sensitive)")
+parser.add_argument("--neighborhoods", nargs="+", default=None, help="neighborhood names (default: all of the municipality)")
+parser.add_argument("--resolution", type=float, default=PREVIEW_RESOLUTION, help="preview pixel size in metres")
+args = parser.parse_args()
+
+buurten_gdf = gpd.read_file("assets/Buurten.csv")
+kaartbladindex_gdf = gpd.read_file("assets/kaartbladindex.json")
+
+for filtered_nl_gdf, neighborhood_name in neighborhood_jobs(buurten_gdf, args.municipality, args.neighborhoods):
+    try:
+        output_json_file = preview_stage(filtered_nl_gdf, neighborhood_name, kaartbladindex_gdf, buurten_gdf, args.resolution)
+    except Exception as e:
+        # e.g. find_matching_index() finds no kaartblad; that only skips this neighborhood
+        print(f"Preview failed for {neighborhood_name}: {e}")
+        continue
+    create_height_maps(output_json_file, os.path.join(PREVIEW_OUTPUT_DIR, neighborhood_name), neighborhood_name)
@@ -0,0 +1,37 @@
+import argparse
+import sys
+
+from utils import *
+
+"""
+Golden-output regression harness: runs the compute stages on the downtown Wageningen
+fixtures in assets/ and reports speed-up and numeric drift per zonal statistics engine.
+Exits with status 1 if any engine drifts beyond the tolerances.
+
+    python Python/regression.py
+    python Python/regression.py --engines rasterstats labels --resolution 0.5
+"""
+
+if __name__ == "__main__":
+    # Spawned workers of the 'parallel' engine import this file as well
+    parser = argparse.ArgumentParser(description="Golden-output regression harness")
+    parser.add_argument("--engines", nargs="+", default=["rasterstats", "labels", "parallel"], help="zonal statistics engines to check")
+    parser.add_argument("--baseline", default="rasterstats", help="engine that speed-up and drift are measured against")
+    parser.add_argument("--resolution", type=float, default=0.5, help="pixel size of the fixture rasters in metres")
+    parser.add_argument("--work-dir", default=None, help="keep intermediate rasters in this folder")
+    args = parser.parse_args()
+
+    report = run_regression(args.engines, args.baseline, args.resolution, args.work_dir)
+
+    print(f"Buildings: {report['buildings']}, reference RMSE: {report['reference_rmse']:.3f} m")
+    for stage, seconds in report["stage_seconds"].items():
+        print(f"{stage}: {seconds:.2f} s")
+    for engine, result in report["engines"].items():
+        print(f"{engine}: zonal {result['zonal_seconds']:.2f} s (warm {result['zonal_warm_seconds']:.2f} s), "
+              f"speed-up x{result['speedup_vs_baseline']:.1f} (warm x{result['warm_speedup_vs_baseline']:.1f}), "
+              f"RMSE {result['rmse']:.3f} m (drift {result['rmse_drift']:.3f}), "
+              f"within {report['tolerances']['height']} m of reference: {result['vs_reference']['within_tolerance']:.1%}, "
+              f"max diff to baseline {result['vs_baseline']['max_abs_diff']:.5f} m -> {'PASS' if result['passed'] else 'FAIL'}")
+    print(f"Report saved as {REGRESSION_REPORT}")
+
+    sys.exit(0 if report["passed"] else 1)
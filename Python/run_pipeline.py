@@ -0,0 +1,59 @@
+import geopandas as gpd
+import os
+
+import numpy as np
+
+from utils import *
+
+"""
+Pipelined batch run: neighborhood N+1 is downloaded while neighborhood N is computed.
+Every selected neighborhood is processed as its own job.
+"""
+
+# Make sure directories exist
+if not os.path.exists('data'):
+    os.makedirs('data')
+if not os.path.exists('output'):
+    os.makedirs('output')
+
+# Load the neighborhoods and the kaartblad index
+buurten_gdf = gpd.read_file("assets/Buurten.csv")
+kaartbladindex_gdf = gpd.read_file("assets/kaartbladindex.json")
+
+# Ask for municipality input
+municipality = input("Please enter the name of the municipality (case sensitive): ")
+sorted_neighborhoods = np.sort(buurten_gdf[buurten_gdf["gm_naam"] == municipality]['bu_naam'].unique())
+
+if len(sorted_neighborhoods) == 0:
+    print(f"No data found for Municipality: {municipality}")
+    raise SystemExit(1)
+
+print(f"Available neighborhoods in {municipality}:")
+for i, neighborhood in enumerate(sorted_neighborhoods, 1):
+    print(f"{i}. {neighborhood}")
+
+# Ask for neighborhoods, or 'all' for the whole municipality, until the input is valid
+neighborhoods = None
+while neighborhoods is None:
+    neighborhood_input = input("Please enter the numbers of the neighborhoods you want (or 'all'): ")
+    if neighborhood_input.strip().lower() == 'all':
+        neighborhoods = list(sorted_neighborhoods)
+        break
+
+    try:
+        # Convert the input to a list of integers
+        neighborhood_indices = list(map(int, neighborhood_input.split()))
+    except ValueError:
+        # Catch non-integer input
+        print("Invalid input. Please enter only numeric values.")
+        continue
+
+    # Check if input indices are within the valid range
+    if not neighborhood_indices or any(i > len(sorted_neighborhoods) or i < 1 for i in neighborhood_indices):
+        print("Invalid input. Please select a valid neighborhood number within the displayed range.")
+        continue
+    neighborhoods = [sorted_neighborhoods[i - 1] for i in neighborhood_indices]
+
+jobs = neighborhood_jobs(buurten_gdf, municipality, neighborhoods)
+finished = run_pipeline(jobs, kaartbladindex_gdf, buurten_gdf, queue_size=2)
+print(f"Pipeline finished {len(finished)} of {len(jobs)} neighborhoods.")
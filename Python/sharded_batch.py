@@ -0,0 +1,59 @@
+import argparse
+import os
+import socket
+from multiprocessing import Process
+
+import geopandas as gpd
+
+from utils import *
+
+"""
+Sharded batch run over a work queue in data/queue/. Every host that mounts the same
+data folder can start workers; a stalled worker's job is picked up again once its lease expires.
+
+    python Python/sharded_batch.py enqueue --municipality Wageningen Ede
+    python Python/sharded_batch.py enqueue                 # all neighborhoods in Buurten.csv
+    python Python/sharded_batch.py work --workers 4
+    python Python/sharded_batch.py report
+"""
+
+
+def start_worker(worker_id, lease_seconds):
+    # Every worker process loads its own copy of the lookup tables
+    buurten_gdf = gpd.read_file("assets/Buurten.csv")
+    kaartbladindex_gdf = gpd.read_file("assets/kaartbladindex.json")
+    finished = run_worker(worker_id, kaartbladindex_gdf, buurten_gdf, lease_seconds=lease_seconds)
+    print(f"Worker {worker_id} finished {finished} jobs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded building height batch run")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="add neighborhood jobs to the queue")
+    enqueue_parser.add_argument("--municipality", nargs="+", help="municipalities to enqueue (default: all)")
+
+    work_parser = subparsers.add_parser("work", help="start local workers")
+    work_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of local worker processes")
+    work_parser.add_argument("--lease", type=int, default=LEASE_SECONDS, help="seconds without heartbeat before a job is recovered")
+
+    subparsers.add_parser("report", help="merge the completion report")
+    args = parser.parse_args()
+
+    os.makedirs('data', exist_ok=True)
+    os.makedirs('output', exist_ok=True)
+
+    if args.command == "enqueue":
+        enqueue_jobs(gpd.read_file("assets/Buurten.csv"), args.municipality)
+
+    elif args.command == "work":
+        host = socket.gethostname()
+        workers = [Process(target=start_worker, args=(f"{host}-{os.getpid()}-{i}", args.lease)) for i in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        merge_completion_report()
+
+    elif args.command == "report":
+        merge_completion_report()
@@ -1,5 +1,5 @@
 import numpy as np
-from osgeo import gdal
+from osgeo import gdal, osr
 gdal.UseExceptions()  # This silences the FutureWarning
 
 from scipy.interpolate import griddata
@@ -25,27 +25,103 @@ def save_raster(output_path, data, transform, projection):
     out_raster.FlushCache()  # Flush the cache to ensure the file is written to disk
     out_band.SetNoDataValue(0)  # Set the no-data value if required (optional)
 
-# Function to subtract the values of two rasters and handle negative values
-def subtract_rasters(raster1_path, raster2_path, output_raster_path):
-    # Step 1: Read the first raster
-    raster1_data, transform1, projection1 = read_raster(raster1_path)
-    
-    # Step 2: Read the second raster
-    raster2_data, transform2, projection2 = read_raster(raster2_path)
-    
-    # Step 3: Check if the dimensions of both rasters match
-    if raster1_data.shape != raster2_data.shape:
-        raise ValueError("The two raster files must have the same dimensions.")
-    
-    # Step 4: Perform the subtraction (raster1 - raster2)
-    result_data = raster1_data - raster2_data
-    
-    # Step 5: Replace negative values with 0 and set any values above 1000 to 0
+# Function to derive the CHM from DSM and DTM arrays and handle negative values
+def chm_from_arrays(dsm_data, dtm_data):
+    # Perform the subtraction (DSM - DTM)
+    result_data = dsm_data - dtm_data
+
+    # Replace negative values with 0 and set any values above 1000 to 0
     result_data[result_data < 0] = 0
     result_data[result_data > 1000] = 0
-    
-    # Step 6: Save the result as a new raster file
-    save_raster(output_raster_path, result_data, transform1, projection1)
+    return result_data
+
+# Function to get the (xmin, ymin, xmax, ymax) extent of a north-up GDAL dataset
+def raster_bounds(ds):
+    transform = ds.GetGeoTransform()
+    xmax = transform[0] + transform[1] * ds.RasterXSize
+    ymin = transform[3] + transform[5] * ds.RasterYSize
+    return transform[0], ymin, xmax, transform[3]
+
+# Function to check whether two GDAL datasets share exactly the same pixel grid
+def same_grid(ds1, ds2, tolerance=1e-6):
+    if (ds1.RasterXSize, ds1.RasterYSize) != (ds2.RasterXSize, ds2.RasterYSize):
+        return False
+    return all(abs(a - b) <= tolerance for a, b in zip(ds1.GetGeoTransform(), ds2.GetGeoTransform()))
+
+# Function to put a raster lazily on another grid: the result is a virtual raster (VRT)
+# that windows and resamples the source only for the pixels that are actually read
+def aligned_virtual_raster(raster_path, bounds, x_res, y_res, vrt_path='', resample_alg='nearest'):
+    return gdal.BuildVRT(vrt_path, [raster_path], outputBounds=bounds, xRes=x_res, yRes=y_res, resampleAlg=resample_alg)
+
+# Function to subtract the values of two rasters and handle negative values
+def subtract_rasters(raster1_path, raster2_path, output_raster_path, block_rows=1024):
+    ds1 = gdal.Open(raster1_path)
+    ds2 = gdal.Open(raster2_path)
+
+    # Fast path: both rasters are on the same grid, subtract them directly
+    if same_grid(ds1, ds2):
+        ds1 = ds2 = None
+
+        # Step 1: Read the first raster
+        raster1_data, transform1, projection1 = read_raster(raster1_path)
+        
+        # Step 2: Read the second raster
+        raster2_data, transform2, projection2 = read_raster(raster2_path)
+        
+        # Step 3: Perform the subtraction (raster1 - raster2) and clean up the result
+        result_data = chm_from_arrays(raster1_data, raster2_data)
+        
+        # Step 4: Save the result as a new raster file
+        save_raster(output_raster_path, result_data, transform1, projection1)
+        return
+
+    # Step 1: Both rasters must be in the same coordinate system (a missing projection is taken as the same)
+    projection1 = ds1.GetProjection()
+    projection2 = ds2.GetProjection()
+    if projection1 and projection2:
+        srs1 = osr.SpatialReference(wkt=projection1)
+        srs2 = osr.SpatialReference(wkt=projection2)
+        if not srs1.IsSame(srs2):
+            raise ValueError("The two raster files must have the same coordinate reference system.")
+
+    # Step 2: The common grid is the intersection of both extents, snapped to the pixels of the first raster
+    transform1 = ds1.GetGeoTransform()
+    x_res, y_res = transform1[1], -transform1[5]
+    bounds1 = raster_bounds(ds1)
+    bounds2 = raster_bounds(ds2)
+    xmin = transform1[0] + np.ceil(round((max(bounds1[0], bounds2[0]) - transform1[0]) / x_res, 6)) * x_res
+    xmax = transform1[0] + np.floor(round((min(bounds1[2], bounds2[2]) - transform1[0]) / x_res, 6)) * x_res
+    ymax = transform1[3] - np.ceil(round((transform1[3] - min(bounds1[3], bounds2[3])) / y_res, 6)) * y_res
+    ymin = transform1[3] - np.floor(round((transform1[3] - max(bounds1[1], bounds2[1])) / y_res, 6)) * y_res
+    if xmax <= xmin or ymax <= ymin:
+        raise ValueError("The two raster files do not overlap.")
+    cols = int(round((xmax - xmin) / x_res))
+    rows = int(round((ymax - ymin) / y_res))
+
+    # Step 3: Virtual rasters of both inputs on the common grid (resample the second only if its pixel size differs)
+    transform2 = ds2.GetGeoTransform()
+    same_resolution = abs(transform2[1] - x_res) < 1e-6 and abs(-transform2[5] - y_res) < 1e-6
+    grid_bounds = (xmin, ymin, xmax, ymax)
+    vrt1 = aligned_virtual_raster(raster1_path, grid_bounds, x_res, y_res)
+    vrt2 = aligned_virtual_raster(raster2_path, grid_bounds, x_res, y_res,
+                                  resample_alg='nearest' if same_resolution else 'bilinear')
+    print(f"Aligned {raster2_path} lazily onto the grid of {raster1_path} ({cols} x {rows} pixels)")
+
+    # Step 4: Subtract block by block, so no full-size copy of either input is made
+    driver = gdal.GetDriverByName('GTiff')
+    out_raster = driver.Create(output_raster_path, cols, rows, 1, gdal.GDT_Float32)
+    out_raster.SetGeoTransform((xmin, x_res, 0, ymax, 0, -y_res))
+    out_raster.SetProjection(projection1 or projection2)
+    out_band = out_raster.GetRasterBand(1)
+    band1 = vrt1.GetRasterBand(1)
+    band2 = vrt2.GetRasterBand(1)
+    for row in range(0, rows, block_rows):
+        n_rows = min(block_rows, rows - row)
+        block = chm_from_arrays(band1.ReadAsArray(0, row, cols, n_rows).astype(np.float32),
+                                band2.ReadAsArray(0, row, cols, n_rows).astype(np.float32))
+        out_band.WriteArray(block, 0, row)
+    out_raster.FlushCache()
+    out_band.SetNoDataValue(0)
 
 
 # Function to interpolate missing values (only for no-data areas)
@@ -1,3 +1,16 @@
+from .archive_store import *
+from .boundary_cache import *
 from .data_download import *
 from .CHM_caluate import *
 from .eval import *
+from .tile_store import *
+from .label_cache import *
+from .parallel_zonal import *
+from .height_dataset import *
+from .pipeline import *
+from .work_queue import *
+from .height_index import *
+from .regression import *
+from .endpoints import *
+from .cityjson_export import *
+from .preview import *
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import zipfile
+
+from .file_lock import file_lock
+from .endpoints import pdok_setting, download_to_file
+
+# One shared store for the kaartblad building-statistics archives, keyed by kaartblad suffix.
+# Neighborhoods hold a reference on the sheets they use from download until their
+# building heights are computed; only unreferenced sheets can be evicted.
+KAARTBLAD_STORE_DIR = "data/kaartblad_store"
+KAARTBLAD_STORE_INDEX = f"{KAARTBLAD_STORE_DIR}/index.json"
+KAARTBLAD_STORE_LOCK = f"{KAARTBLAD_STORE_DIR}/index.lock"
+KAARTBLAD_STORE_MAX_BYTES = 20 * 1024 ** 3
+KAARTBLAD_ARCHIVE_NAME = "{suffix}_2020_hoogtestatistieken_gebouwen.zip"
+
+
+def _load_index():
+    if not os.path.exists(KAARTBLAD_STORE_INDEX):
+        return {}
+    with open(KAARTBLAD_STORE_INDEX, 'r') as f:
+        return json.load(f)
+
+
+def _save_index(index):
+    # Replace the index atomically so an interrupted run never leaves it half-written
+    tmp_path = f"{KAARTBLAD_STORE_INDEX}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, KAARTBLAD_STORE_INDEX)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _entry_is_valid(entry, verify):
+    # Cheap check on every use, full checksum only on request
+    if not os.path.exists(entry["gpkg"]) or os.path.getsize(entry["gpkg"]) != entry["size"]:
+        return False
+    if verify and _sha256(entry["gpkg"]) != entry["sha256"]:
+        return False
+    return True
+
+
+def _download_kaartblad(suffix):
+    # Stream the archive to disk, check the zip and keep only the extracted gpkg
+    zip_path = f"{KAARTBLAD_STORE_DIR}/{suffix}_2020_hoogtestatistieken_gebouwen.zip.{os.getpid()}.tmp"
+    gpkg_name = f"{suffix}_2020_hoogtestatistieken_gebouwen.gpkg"
+
+    url = f"{pdok_setting('PDOK_DOWNLOAD_URL')}/{KAARTBLAD_ARCHIVE_NAME.format(suffix=suffix)}"
+    print(f"Downloading: {url}")
+    download_to_file(url, zip_path)
+
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            bad_member = zip_ref.testzip()
+            if bad_member is not None:
+                raise zipfile.BadZipFile(f"Corrupt member {bad_member} in archive of kaartblad {suffix}")
+            # Extract under a temporary name so the sheet only appears once complete
+            gpkg_path = f"{KAARTBLAD_STORE_DIR}/{gpkg_name}"
+            with zip_ref.open(gpkg_name) as source, open(f"{gpkg_path}.tmp", 'wb') as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+            os.replace(f"{gpkg_path}.tmp", gpkg_path)
+    finally:
+        os.remove(zip_path)
+
+    return {
+        "gpkg": gpkg_path,
+        "size": os.path.getsize(gpkg_path),
+        "sha256": _sha256(gpkg_path),
+        "last_access": time.time(),
+        "refs": []
+    }
+
+
+def acquire_kaartblad_archive(suffix, neighborhood_name, verify=False):
+    """
+    Returns the building-statistics gpkg of a kaartblad from the shared store, downloading
+    it only if it is missing or fails the integrity check, and records that the
+    neighborhood references it.
+
+    Parameters:
+    suffix (str): The kaartblad suffix, e.g. '39fn2'.
+    neighborhood_name (str): The neighborhood that will use the sheet.
+    verify (bool): Also compare the SHA-256 checksum, not only the file size.
+
+    Returns:
+    str: Path to the gpkg file in the store.
+    """
+    os.makedirs(KAARTBLAD_STORE_DIR, exist_ok=True)
+
+    # The per-sheet lock makes concurrent workers wait for one download instead of repeating it,
+    # and keeps evict_kaartblad_archives() away from the sheet; the index lock is only held for
+    # the short index updates
+    with file_lock(f"{KAARTBLAD_STORE_DIR}/{suffix}.lock"):
+        while True:
+            with file_lock(KAARTBLAD_STORE_LOCK):
+                entry = _load_index().get(suffix)
+
+            if entry is None or not _entry_is_valid(entry, verify):
+                downloaded_entry = _download_kaartblad(suffix)
+            else:
+                downloaded_entry = None
+                print(f"Already in kaartblad store: {entry['gpkg']}")
+
+            # Check the sheet again and register the reference in one locked step, so it cannot
+            # disappear between the check and the reference
+            with file_lock(KAARTBLAD_STORE_LOCK):
+                index = _load_index()
+                entry = index.get(suffix)
+                if downloaded_entry is None and (entry is None or not _entry_is_valid(entry, False)):
+                    continue  # Removed meanwhile; download it again
+                if downloaded_entry is not None:
+                    downloaded_entry["refs"] = entry["refs"] if entry is not None else []
+                    entry = downloaded_entry
+
+                if neighborhood_name not in entry["refs"]:
+                    entry["refs"].append(neighborhood_name)
+                entry["last_access"] = time.time()
+                index[suffix] = entry
+                _save_index(index)
+                break
+
+    return entry["gpkg"]
+
+
+def release_kaartblad_archives(neighborhood_name):
+    """Drops the references of a neighborhood on all kaartblad sheets in the store."""
+    with file_lock(KAARTBLAD_STORE_LOCK):
+        index = _load_index()
+        for entry in index.values():
+            if neighborhood_name in entry["refs"]:
+                entry["refs"].remove(neighborhood_name)
+        _save_index(index)
+
+
+def evict_kaartblad_archives(max_bytes=KAARTBLAD_STORE_MAX_BYTES):
+    """
+    Deletes least recently used, unreferenced sheets until the store fits in `max_bytes`.
+
+    Parameters:
+    max_bytes (int): Disk-size cap of the store in bytes.
+
+    Returns:
+    list: The kaartblad suffixes that were evicted.
+    """
+    with file_lock(KAARTBLAD_STORE_LOCK):
+        index = _load_index()
+        total_size = sum(entry["size"] for entry in index.values())
+        evicted = []
+
+        for suffix, entry in sorted(index.items(), key=lambda item: item[1]["last_access"]):
+            if total_size <= max_bytes:
+                break
+            if entry["refs"]:
+                continue
+            # A sheet that is being acquired is skipped instead of waited for, since the acquiring
+            # worker takes the sheet lock before the index lock held here
+            with file_lock(f"{KAARTBLAD_STORE_DIR}/{suffix}.lock", blocking=False) as acquired:
+                if not acquired:
+                    continue
+                if os.path.exists(entry["gpkg"]):
+                    os.remove(entry["gpkg"])
+            total_size -= entry["size"]
+            evicted.append(suffix)
+            print(f"Evicted kaartblad {suffix} from the store")
+
+        for suffix in evicted:
+            del index[suffix]
+        _save_index(index)
+    return evicted
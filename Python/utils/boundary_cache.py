@@ -0,0 +1,132 @@
+import io
+import os
+
+import geopandas as gpd
+import pandas as pd
+
+import requests
+
+from .file_lock import file_lock
+from .endpoints import pdok_setting, get_with_retries
+
+# Local cache of neighborhood (buurt) boundaries keyed by buurtcode. The GeoPackage keeps
+# an R-tree spatial index, so later selections and bbox lookups are answered offline.
+BOUNDARY_CACHE_PATH = "data/boundary_nl/buurten_cache.gpkg"
+BOUNDARY_CACHE_LAYER = "buurten"
+BOUNDARY_CACHE_LOCK = "data/boundary_nl/buurten_cache.lock"
+BOUNDARY_CHUNK_SIZE = 50
+
+
+def _buurtcode_filter_url(buurtcodes):
+    # Build a GetFeature URL with one PropertyIsEqualTo clause per buurtcode
+    url_head = pdok_setting("PDOK_WFS_URL") + '?request=GetFeature&service=WFS&version=1.1.0&typeName=wb2021:buurten&filter=%3CFilter%3E'
+    url_single_buurtcode_start = '%3CPropertyIsEqualTo%20matchCase=%22true%22%3E%3CValueReference%3Ebuurtcode%3C/ValueReference%3E%3CLiteral%3E'
+    url_single_buurtcode_end = '%3C/Literal%3E%3C/PropertyIsEqualTo%3E'
+    url_end = '%3C/Filter%3E'
+
+    # If there are multiple buurtcodes, wrap them with <Or> tags
+    if len(buurtcodes) > 1:
+        url_head += '%3COr%3E'
+        url_end = '%3C/Or%3E' + url_end
+
+    for buurtcode in buurtcodes:
+        url_head += url_single_buurtcode_start + buurtcode + url_single_buurtcode_end
+
+    return url_head + url_end
+
+
+def fetch_buurt_boundaries(buurtcodes, chunk_size=BOUNDARY_CHUNK_SIZE):
+    """
+    Downloads neighborhood boundaries from the wijkenbuurten WFS in chunks of `chunk_size`
+    buurtcodes, so large selections stay below URL length limits.
+
+    Parameters:
+    buurtcodes (list): The buurtcodes to download.
+    chunk_size (int): Maximum number of buurtcodes per request.
+
+    Returns:
+    GeoDataFrame: The downloaded boundaries (chunks that failed are left out).
+    """
+    buurtcodes = list(buurtcodes)
+    chunks = []
+
+    for start in range(0, len(buurtcodes), chunk_size):
+        chunk_codes = buurtcodes[start:start + chunk_size]
+        try:
+            response = get_with_retries(_buurtcode_filter_url(chunk_codes))
+        except requests.RequestException as e:
+            print(f"Failed to download data: {e}")
+            continue
+
+        chunks.append(gpd.read_file(io.BytesIO(response.content)))
+        print(f"Downloaded boundaries of {len(chunk_codes)} neighborhoods")
+
+    if not chunks:
+        return gpd.GeoDataFrame()
+    return gpd.GeoDataFrame(pd.concat(chunks, ignore_index=True), crs=chunks[0].crs)
+
+
+def load_cached_boundaries(buurtcodes=None, bbox=None):
+    """
+    Reads neighborhood boundaries from the local cache.
+
+    Parameters:
+    buurtcodes (list, optional): Only return these buurtcodes.
+    bbox (tuple, optional): Only return boundaries intersecting (xmin, ymin, xmax, ymax),
+    answered through the spatial index of the cache.
+
+    Returns:
+    GeoDataFrame: The cached boundaries (empty if nothing is cached).
+    """
+    if not os.path.exists(BOUNDARY_CACHE_PATH):
+        return gpd.GeoDataFrame()
+
+    read_kwargs = {"layer": BOUNDARY_CACHE_LAYER}
+    if bbox is not None:
+        read_kwargs["bbox"] = bbox
+    if buurtcodes is not None:
+        if len(buurtcodes) == 0:
+            return gpd.GeoDataFrame()
+        read_kwargs["where"] = "buurtcode IN ({})".format(", ".join(f"'{code}'" for code in buurtcodes))
+
+    return gpd.read_file(BOUNDARY_CACHE_PATH, **read_kwargs)
+
+
+def cache_boundaries(boundary_gdf):
+    """Appends downloaded boundaries to the local cache."""
+    if boundary_gdf.empty:
+        return
+    os.makedirs(os.path.dirname(BOUNDARY_CACHE_PATH), exist_ok=True)
+    mode = 'a' if os.path.exists(BOUNDARY_CACHE_PATH) else 'w'
+    boundary_gdf.to_file(BOUNDARY_CACHE_PATH, layer=BOUNDARY_CACHE_LAYER, driver='GPKG', mode=mode)
+
+
+def get_buurt_boundaries(buurtcodes, prefetch_codes=None):
+    """
+    Returns the boundaries of the requested buurtcodes, downloading only the ones that are
+    not cached yet. Codes in `prefetch_codes` (e.g. the whole municipality) are fetched in
+    the same batch, so later selections need no extra requests.
+
+    Parameters:
+    buurtcodes (list): The buurtcodes to return.
+    prefetch_codes (list, optional): Additional buurtcodes to download into the cache.
+
+    Returns:
+    GeoDataFrame: The boundaries of `buurtcodes`.
+    """
+    buurtcodes = list(buurtcodes)
+    wanted_codes = list(dict.fromkeys(buurtcodes + list(prefetch_codes if prefetch_codes is not None else [])))
+
+    # Only one worker at a time may look up and append missing boundaries
+    with file_lock(BOUNDARY_CACHE_LOCK):
+        cached_gdf = load_cached_boundaries(wanted_codes)
+        cached_codes = set(cached_gdf['buurtcode']) if not cached_gdf.empty else set()
+        missing_codes = [code for code in wanted_codes if code not in cached_codes]
+
+        if missing_codes:
+            print(f"{len(missing_codes)} neighborhood boundaries not cached yet, downloading...")
+            cache_boundaries(fetch_buurt_boundaries(missing_codes))
+        else:
+            print("All neighborhood boundaries answered from the local cache.")
+
+    return load_cached_boundaries(buurtcodes)
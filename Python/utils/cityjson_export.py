@@ -0,0 +1,213 @@
+import os
+import json
+import math
+
+import numpy as np
+import geopandas as gpd
+import pyogrio
+import rasterio
+import shapely
+from shapely.geometry import MultiPolygon
+from shapely.geometry.polygon import orient
+
+# LoD1 block models are written as CityJSON Text Sequences (CityJSONSeq): one header line
+# followed by one self-contained CityJSONFeature per line, so a whole municipality can be
+# streamed out chunk by chunk without holding the city model in memory.
+CITYJSON_VERSION = "2.0"
+CITYJSON_SCALE = 0.001
+# With ground heights the solids stand on the gap-filled DTM, in RD New + NAP heights;
+# without, z is the height above ground level (0 = ground) on the RD New plane
+CITYJSON_CRS = "https://www.opengis.net/def/crs/EPSG/0/7415"
+CITYJSON_CRS_RELATIVE = "https://www.opengis.net/def/crs/EPSG/0/28992"
+GROUND_RASTER_DIR = "data/DTM_filtered"
+
+
+def _quantize(x, y, z, translate):
+    return (int(round((x - translate[0]) / CITYJSON_SCALE)),
+            int(round((y - translate[1]) / CITYJSON_SCALE)),
+            int(round((z - translate[2]) / CITYJSON_SCALE)))
+
+
+def _ring_indices(ring, z, translate, vertex_index, vertices):
+    # Map a ring to deduplicated vertex indices (a vertex shared by walls, floor and roof is stored once)
+    indices = []
+    for x, y in ring.coords[:-1]:
+        key = _quantize(x, y, z, translate)
+        if key not in vertex_index:
+            vertex_index[key] = len(vertices)
+            vertices.append(list(key))
+        index = vertex_index[key]
+        if not indices or indices[-1] != index:
+            indices.append(index)
+    if len(indices) > 1 and indices[0] == indices[-1]:
+        indices.pop()
+    return indices
+
+
+def _solid_shell(polygon, height, translate, vertex_index, vertices, base=0.0):
+    """Returns the outer shell of the polygon extruded from `base` to `base + height`, oriented outwards."""
+    polygon = orient(polygon, sign=1.0)  # exterior counter-clockwise, holes clockwise
+    rings = [polygon.exterior] + list(polygon.interiors)
+
+    bottom = [_ring_indices(ring, base, translate, vertex_index, vertices) for ring in rings]
+    top = [_ring_indices(ring, base + height, translate, vertex_index, vertices) for ring in rings]
+    if len(bottom[0]) < 3:
+        return None
+
+    # Floor faces down (reversed rings), roof faces up
+    shell = [[list(reversed(ring)) for ring in bottom if len(ring) >= 3],
+             [ring for ring in top if len(ring) >= 3]]
+
+    # One wall per edge; with counter-clockwise exteriors and clockwise holes, (a0, b0, b1, a1) faces outwards
+    for bottom_ring, top_ring in zip(bottom, top):
+        if len(bottom_ring) < 3 or len(bottom_ring) != len(top_ring):
+            continue
+        for i in range(len(bottom_ring)):
+            j = (i + 1) % len(bottom_ring)
+            shell.append([[bottom_ring[i], bottom_ring[j], top_ring[j], top_ring[i]]])
+    return shell
+
+
+def building_feature(object_id, geometry, height, translate, attributes=None, base=0.0):
+    """
+    Builds the CityJSONFeature of one LoD1 building: its footprint extruded from `base` to
+    `base + height` metres.
+
+    Parameters:
+    object_id (str): ID of the city object.
+    geometry (Polygon or MultiPolygon): Footprint in EPSG:28992.
+    height (float): Estimated building height in metres.
+    translate (list): [x, y, z] translation of the CityJSON transform.
+    attributes (dict, optional): Extra attributes of the city object.
+    base (float): Ground height of the footprint (NAP metres), or 0 for heights relative to ground level.
+
+    Returns:
+    dict or None: The CityJSONFeature, or None for empty or degenerate footprints.
+    """
+    polygons = list(geometry.geoms) if isinstance(geometry, MultiPolygon) else [geometry]
+    vertex_index = {}
+    vertices = []
+    shells = [shell for shell in (_solid_shell(polygon, height, translate, vertex_index, vertices, base)
+                                  for polygon in polygons if not polygon.is_empty) if shell is not None]
+    if not shells:
+        return None
+
+    if len(shells) == 1:
+        lod1_geometry = {"type": "Solid", "lod": "1", "boundaries": [shells[0]]}
+    else:
+        lod1_geometry = {"type": "MultiSolid", "lod": "1", "boundaries": [[shell] for shell in shells]}
+
+    return {
+        "type": "CityJSONFeature",
+        "id": object_id,
+        "CityObjects": {
+            object_id: {
+                "type": "Building",
+                "attributes": dict(attributes or {}, measuredHeight=height),
+                "geometry": [lod1_geometry]
+            }
+        },
+        "vertices": vertices
+    }
+
+
+def _read_chunks(path, chunk_size):
+    # Stream a building height file in record batches, so every file is opened and parsed once
+    with pyogrio.open_arrow(path, columns=["MeanValue"], batch_size=chunk_size, use_pyarrow=True) as (meta, reader):
+        geometry_column = meta["geometry_name"] or "wkb_geometry"
+        for batch in reader:
+            geometries = gpd.GeoSeries(shapely.from_wkb(batch.column(geometry_column).to_numpy(zero_copy_only=False)),
+                                       crs=meta["crs"]).to_crs(epsg=28992)
+            yield geometries, batch.column("MeanValue").to_pylist()
+
+
+def ground_raster_path(neighborhood_name):
+    """Returns the gap-filled DTM window of a neighborhood, cut by compute_chm()."""
+    return f"{GROUND_RASTER_DIR}/{neighborhood_name}_dtm_05m.tif"
+
+
+def _ground_heights(ground_raster, geometries):
+    # Ground height below each footprint, sampled at a point inside it (no-data is stored as 0)
+    bases = np.zeros(len(geometries))
+    valid = np.flatnonzero(~(geometries.isna() | geometries.is_empty).values)
+    points = geometries.iloc[valid].representative_point()
+    for i, value in zip(valid, ground_raster.sample([(p.x, p.y) for p in points])):
+        bases[i] = float(value[0])
+    return bases.tolist()
+
+
+def export_cityjsonseq(building_height_paths, output_path, chunk_size=1000, ground=True):
+    """
+    Streams the LoD1 block models of estimated building heights into a CityJSONSeq file.
+    Every input file is read once, `chunk_size` buildings at a time, and every chunk is
+    flushed to disk before the next one is read; buildings without a height are skipped.
+
+    With `ground`, every solid stands on the gap-filled DTM of its neighborhood (see
+    ground_raster_path), so z is in NAP metres (EPSG:7415). Without it, z is the height
+    above ground level and the floor of every solid lies at z = 0.
+
+    Parameters:
+    building_height_paths (list): Building height GeoJSON files, e.g. from output/estimated_building_height/.
+    output_path (str): Path of the .city.jsonl file to write.
+    chunk_size (int): Number of buildings read and written at a time.
+    ground (bool): Place the solids on the DTM instead of at z = 0.
+
+    Returns:
+    int: The number of buildings written.
+    """
+    neighborhood_names = [os.path.splitext(os.path.basename(path))[0] for path in building_height_paths]
+    if ground:
+        missing = [name for name in neighborhood_names if not os.path.exists(ground_raster_path(name))]
+        if missing:
+            raise FileNotFoundError(f"No gap-filled DTM for {', '.join(missing)}; compute the CHM first or export relative heights")
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    written = 0
+    translate = None
+    with open(output_path, 'w') as output_file:
+        for path, neighborhood_name in zip(building_height_paths, neighborhood_names):
+            ground_raster = rasterio.open(ground_raster_path(neighborhood_name)) if ground else None
+            start = 0
+            try:
+                for geometries, heights in _read_chunks(path, chunk_size):
+                    # The header goes first and needs the translation, so it is derived from the first chunk
+                    if translate is None:
+                        xmin, ymin, _, _ = geometries.total_bounds
+                        translate = [math.floor(xmin), math.floor(ymin), 0]
+                        header = {
+                            "type": "CityJSON",
+                            "version": CITYJSON_VERSION,
+                            "transform": {"scale": [CITYJSON_SCALE] * 3, "translate": translate},
+                            "metadata": {"referenceSystem": CITYJSON_CRS if ground else CITYJSON_CRS_RELATIVE},
+                            "CityObjects": {},
+                            "vertices": []
+                        }
+                        output_file.write(json.dumps(header) + "\n")
+
+                    bases = _ground_heights(ground_raster, geometries) if ground else [0.0] * len(geometries)
+                    lines = []
+                    for offset, (geometry, height, base) in enumerate(zip(geometries, heights, bases)):
+                        if geometry is None or height is None or not height > 0:
+                            continue
+                        attributes = {"neighborhood": neighborhood_name}
+                        if ground:
+                            attributes["groundHeight"] = base
+                        feature = building_feature(f"{neighborhood_name}-{start + offset}", geometry, float(height), translate,
+                                                   attributes, base)
+                        if feature is not None:
+                            lines.append(json.dumps(feature, separators=(",", ":")))
+
+                    if lines:
+                        output_file.write("\n".join(lines) + "\n")
+                        output_file.flush()
+                    written += len(lines)
+                    start += len(geometries)
+            finally:
+                if ground_raster is not None:
+                    ground_raster.close()
+
+    print(f"{written} LoD1 buildings exported to {output_path}")
+    return written
@@ -1,15 +1,13 @@
 import os
-import sys
-
-import zipfile
+import shutil
 
 import geopandas as gpd
 import pandas as pd
 import numpy as np
 
-import requests
-
-from owslib.wcs import WebCoverageService
+from .endpoints import pdok_setting, download_to_file
+from .archive_store import acquire_kaartblad_archive
+from .boundary_cache import get_buurt_boundaries
 
 
 def filter_neighborhoods_by_municipality(buurten_gdf):
@@ -88,14 +86,17 @@ def filter_neighborhoods_by_municipality(buurten_gdf):
     return filtered_nl_gdf, neighborhoods_str  # Return the filtered GeoDataFrame
 
 
-def download_neighborhood_data(filtered_nl_gdf, neighborhood_name):
+def download_neighborhood_data(filtered_nl_gdf, neighborhood_name, buurten_gdf=None):
     """
-    This function generates a WFS request URL based on the provided GeoDataFrame and downloads
-    the corresponding neighborhood data as a GeoJSON file.
+    This function retrieves the neighborhood boundaries of the provided GeoDataFrame, from the
+    local boundary cache where possible and otherwise through chunked WFS requests, and saves
+    them as a GeoJSON file.
     
     Parameters:
     filtered_nl_gdf (GeoDataFrame): The filtered GeoDataFrame containing the selected neighborhoods.
     neighborhood_name (str): The name of the neighborhood(s), which will be used for naming the output file.
+    buurten_gdf (GeoDataFrame, optional): All neighborhoods; when given, the boundaries of the whole
+    municipality are fetched into the cache in the same batch.
 
     Returns:
     GeoDataFrame or None: Returns the downloaded data as a GeoDataFrame if successful, otherwise returns None.
@@ -104,42 +105,32 @@ def download_neighborhood_data(filtered_nl_gdf, neighborhood_name):
     # Extract all matching bu_codes
     buurtcodes = filtered_nl_gdf['bu_code'].values
 
-    # Construct the URL
-    url_head = 'https://service.pdok.nl/cbs/wijkenbuurten/2023/wfs/v1_0?request=GetFeature&service=WFS&version=1.1.0&typeName=wb2021:buurten&filter=%3CFilter%3E'
-    url_single_buurtcode_start = '%3CPropertyIsEqualTo%20matchCase=%22true%22%3E%3CValueReference%3Ebuurtcode%3C/ValueReference%3E%3CLiteral%3E'
-    url_single_buurtcode_end = '%3C/Literal%3E%3C/PropertyIsEqualTo%3E'
-    url_end = '%3C/Filter%3E'
+    # Fetch the rest of the municipality along with the selection
+    prefetch_codes = None
+    if buurten_gdf is not None:
+        municipalities = filtered_nl_gdf['gm_naam'].unique()
+        prefetch_codes = buurten_gdf[buurten_gdf['gm_naam'].isin(municipalities)]['bu_code'].values
 
-    # If there are multiple buurtcodes, wrap them with <Or> tags
-    if len(buurtcodes) > 1:
-        url_head += '%3COr%3E'
-        url_end = '%3C/Or%3E' + url_end
+    gdf = get_buurt_boundaries(buurtcodes, prefetch_codes)
 
-    # Append each buurtcode to the URL
-    for buurtcode in buurtcodes:
-        url_head += url_single_buurtcode_start + buurtcode + url_single_buurtcode_end
+    if gdf.empty:
+        print("Failed to download neighborhood boundary data.")
+        return None  # Return None if the download failed
 
-    download_url = url_head + url_end
+    # A failed chunk leaves neighborhoods out; a partial boundary would silently shrink the study area
+    missing_codes = sorted(set(buurtcodes) - set(gdf['buurtcode']))
+    if missing_codes:
+        print(f"Failed to download the boundaries of {len(missing_codes)} neighborhood(s): {', '.join(missing_codes)}")
+        return None
 
     # Set the download path
     download_path = f"data/boundary_nl/{neighborhood_name}.geojson"
 
-    # Download the data from the constructed URL
-    response = requests.get(download_url)
-    
-    if response.status_code == 200:
-        # Save the response content to a GeoJSON file
-        with open(download_path, "w") as f:
-            f.write(response.text)
-        print(f"neighborhood boundary data downloaded successfully to {download_path}")
-
-        # Load the GeoJSON file into a GeoDataFrame
-        gdf = gpd.read_file(download_path)
+    # Save the boundaries to a GeoJSON file
+    gdf.to_file(download_path, driver='GeoJSON')
+    print(f"neighborhood boundary data saved successfully to {download_path}")
 
-        return gdf  # Return the downloaded GeoDataFrame
-    else:
-        print(f"Failed to download data. HTTP status code: {response.status_code}")
-        return None  # Return None if the download failed
+    return gdf  # Return the downloaded GeoDataFrame
 
 
 def find_matching_index(nl_boundary_gdf, kaartbladindex_gdf):
@@ -153,7 +144,7 @@ def find_matching_index(nl_boundary_gdf, kaartbladindex_gdf):
     kaartbladindex_gdf (GeoDataFrame): GeoDataFrame containing the target geometries.
 
     Returns:
-    GeoDataFrame: Returns the matching rows from kaartbladindex_gdf.
+    GeoDataFrame: Returns the matching rows from kaartbladindex_gdf. Raises LookupError if no sheet matches.
     """
     matching_rows = []
 
@@ -190,13 +181,12 @@ def find_matching_index(nl_boundary_gdf, kaartbladindex_gdf):
                 return result_gdf, kaartbladNr_suffix 
             else:
                 print("no attached rows")
-            sys.exit()
         else:
             print("still we can't find this neighborhood")
-            sys.exit()
 
         print("Converting input neighborhood may sometime not succeed! \nPlease choose another neighborhood then!")
-        sys.exit()  # Or use `sys.exit()` to terminate the program
+        # Raise instead of exiting, so batch runs only fail this neighborhood and can report why
+        raise LookupError("no matching kaartblad sheet for the neighborhood boundary")
 
     # Extract the part after the underscore in the 'kaartbladNr' column
     kaartbladNr_suffix_single_result = result_gdf['kaartbladNr'].str.split('_').str[1].loc[0].lower()
@@ -251,13 +241,15 @@ def find_matching_index(nl_boundary_gdf, kaartbladindex_gdf):
 def download_and_extract_building_boundaries(matching_kaartbladindex_kaartbladNr_suffix, neighborhood_name):
     """
     Downloads and extracts building boundary data for a specific neighborhood.
+    The kaartblad archives come from the shared kaartblad store, so each sheet is
+    downloaded once no matter how many neighborhoods use it.
     
     Parameters:
     matching_kaartbladindex_kaartbladNr_suffix (str or list): The suffix used to generate the file URL. Can be a string or a list of strings.
     neighborhood_name (str): The name of the neighborhood for file naming.
 
     Returns:
-    None
+    str: The neighborhood folder holding the building boundary gpkg.
     """
     # Create directory for boundary data if it doesn't exist
     base_dir = "data//boundary_building"
@@ -268,48 +260,15 @@ def download_and_extract_building_boundaries(matching_kaartbladindex_kaartbladNr
     if isinstance(matching_kaartbladindex_kaartbladNr_suffix, str):
         matching_kaartbladindex_kaartbladNr_suffix = [matching_kaartbladindex_kaartbladNr_suffix]
 
-    # List to store the paths of extracted gpkg files
-    extracted_dpkg_paths = []
+    nl_building_boundary_extract_dir = f"{base_dir}//{neighborhood_name}//"
 
     # Make sure directories exist
-    if not os.path.exists(f"data//boundary_building//{neighborhood_name}"):
-        os.makedirs(f"data//boundary_building//{neighborhood_name}")
-
-    # Loop through all suffixes in the list
-    for suffix in matching_kaartbladindex_kaartbladNr_suffix:
-        # Generate the download URL and file paths
-        nl_building_boundary_url = ("https://download.pdok.nl/kadaster/basisvoorziening-3d/v1_0/2020/hoogtestatistieken/" +
-                                    suffix + "_2020_hoogtestatistieken_gebouwen.zip")
-        
-        nl_building_boundary_zip_file_path = f"{base_dir}//{neighborhood_name}//{suffix}_2020_hoogtestatistieken_gebouwen.zip"
-        nl_building_boundary_unzip_file_path = f"{base_dir}//{neighborhood_name}//{suffix}_2020_hoogtestatistieken_gebouwen.gpkg"
-
-        nl_building_boundary_extract_dir = f"{base_dir}//{neighborhood_name}//"
-
-        # print('nl_building_boundary_unzip_file_path: ', nl_building_boundary_unzip_file_path)
+    if not os.path.exists(nl_building_boundary_extract_dir):
+        os.makedirs(nl_building_boundary_extract_dir)
 
-        # Check if the zip file already exists, if not, download it
-        if not os.path.exists(nl_building_boundary_zip_file_path):
-            response = requests.get(nl_building_boundary_url)
-            with open(nl_building_boundary_zip_file_path, 'wb') as file:
-                file.write(response.content)
-                print(f"Downloading: {nl_building_boundary_zip_file_path}")
-        else:
-            print(f"Already downloaded: {nl_building_boundary_zip_file_path}")
-
-        # Check if the extracted directory exists, if not, create the directory and extract the zip file
-        if not os.path.exists(nl_building_boundary_unzip_file_path):
-            with zipfile.ZipFile(nl_building_boundary_zip_file_path, 'r') as zip_ref:
-                zip_ref.extractall(nl_building_boundary_extract_dir)
-                print(f"Extracting to: {nl_building_boundary_extract_dir}")
-        else:
-            print(f"Already extracted: {nl_building_boundary_unzip_file_path}")
-
-        if os.path.exists(nl_building_boundary_extract_dir):
-            extracted_dpkg_paths.append(nl_building_boundary_unzip_file_path)
-
-    # print('extracted_dpkg_paths: ', extracted_dpkg_paths)
-    # exit(0)
+    # Get the gpkg of every sheet from the store (downloaded only when missing)
+    extracted_dpkg_paths = [acquire_kaartblad_archive(suffix, neighborhood_name)
+                            for suffix in matching_kaartbladindex_kaartbladNr_suffix]
 
     # If multiple gpkg files are extracted, merge them
     if len(extracted_dpkg_paths) > 1:
@@ -326,27 +285,39 @@ def download_and_extract_building_boundaries(matching_kaartbladindex_kaartbladNr
             merged_gdf = merged_gdf.drop(columns=['fid'])
         merged_gdf.to_file(merged_dpkg_file, driver='GPKG')
         print(f"Merged gpkg file saved to: {merged_dpkg_file}")
-
-        # Remove the original gpkg files
-        for dpkg_file in extracted_dpkg_paths:
-            os.remove(dpkg_file)
-            print(f"Deleted old gpkg file: {dpkg_file}")
     else:
+        # Link the single sheet into the neighborhood folder instead of copying it
+        nl_building_boundary_unzip_file_path = os.path.join(nl_building_boundary_extract_dir, os.path.basename(extracted_dpkg_paths[0]))
+        if not os.path.exists(nl_building_boundary_unzip_file_path):
+            try:
+                os.link(extracted_dpkg_paths[0], nl_building_boundary_unzip_file_path)
+            except OSError:
+                shutil.copyfile(extracted_dpkg_paths[0], nl_building_boundary_unzip_file_path)
         print("No multiple gpkg files to merge.")
     
     return nl_building_boundary_extract_dir
 
 
-def ahn_05m_for_study_area(extent, output_filename, coverage_id):
+def ahn_05m_for_study_area(extent, output_filename, coverage_id, resolution=2.5):
     """This function extracts for a given extent (bbox) the AHN3 Digital Elevation Model (DEM) or
-    Digital Terrain Model (DTM) at 0.5m resolution and saves as a GeoTIFF."""
-    # Specify the AHN3 WCS URL
-    wcs = WebCoverageService('https://service.pdok.nl/rws/ahn/wcs/v1_0?SERVICE=WCS', version='1.0.0')
-    
+    Digital Terrain Model (DTM) from the 0.5m coverage, resampled to `resolution` metres, and saves as a GeoTIFF.
+    The WCS 1.0.0 GetCoverage request is sent directly (PDOK_WCS_URL), without a GetCapabilities round trip."""
     # Download and save the raster (DEM or DTM) as specified by coverage_id
-    response = wcs.getCoverage(identifier=coverage_id, bbox=extent, format='image/tiff',
-                               crs='urn:ogc:def:crs:EPSG::28992', resx=2.5, resy=2.5)
-
-    with open(output_filename, 'wb') as file:
-        file.write(response.read())
+    params = {
+        'SERVICE': 'WCS',
+        'VERSION': '1.0.0',
+        'REQUEST': 'GetCoverage',
+        'COVERAGE': coverage_id,
+        'CRS': 'urn:ogc:def:crs:EPSG::28992',
+        'BBOX': ','.join(str(value) for value in extent),
+        'RESX': resolution,
+        'RESY': resolution,
+        'FORMAT': 'image/tiff'
+    }
+    response = download_to_file(pdok_setting("PDOK_WCS_URL"), output_filename, params=params)
+
+    # A service exception comes back as XML instead of a GeoTIFF
+    if 'xml' in response.headers.get('Content-Type', ''):
+        with open(output_filename, 'r') as file:
+            raise RuntimeError(f"WCS request for {coverage_id} failed: {file.read()[:500]}")
     print(f"{coverage_id} downloaded and saved as {output_filename}")
@@ -0,0 +1,83 @@
+import os
+import time
+
+import requests
+
+# PDOK endpoints, configurable through environment variables so the download stage can be
+# pointed at a local stand-in server (see pdok_standin.py) for offline tests and benchmarks.
+# They are looked up on every request, so variables set after importing utils (e.g. for a
+# stand-in started in the same process) take effect.
+PDOK_DEFAULTS = {
+    "PDOK_WFS_URL": "https://service.pdok.nl/cbs/wijkenbuurten/2023/wfs/v1_0",
+    "PDOK_WCS_URL": "https://service.pdok.nl/rws/ahn/wcs/v1_0",
+    "PDOK_DOWNLOAD_URL": "https://download.pdok.nl/kadaster/basisvoorziening-3d/v1_0/2020/hoogtestatistieken",
+    "PDOK_RETRIES": "3",
+    "PDOK_TIMEOUT": "300",
+    "PDOK_RETRY_BACKOFF": "2"
+}
+
+
+def pdok_setting(name):
+    """Returns a PDOK endpoint or download setting (see PDOK_DEFAULTS) from the environment, or its default."""
+    return os.environ.get(name, PDOK_DEFAULTS[name])
+
+
+def download_to_file(url, output_path, params=None, retries=None):
+    """
+    Streams a download to a file, retrying with exponential backoff on connection errors,
+    HTTP 5xx responses and truncated bodies (fewer bytes than the announced Content-Length).
+
+    Parameters:
+    url (str): The URL to download.
+    output_path (str): The file to write.
+    params (dict, optional): Query parameters.
+    retries (int, optional): Number of retries after the first attempt (default: PDOK_RETRIES).
+
+    Returns:
+    requests.Response: The (closed) final response, e.g. to inspect its headers.
+    """
+    retries = int(pdok_setting("PDOK_RETRIES")) if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            with requests.get(url, params=params, stream=True, timeout=float(pdok_setting("PDOK_TIMEOUT"))) as response:
+                response.raise_for_status()
+                written = 0
+                with open(output_path, 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        file.write(chunk)
+                        written += len(chunk)
+
+                expected = response.headers.get("Content-Length")
+                if expected is not None and written != int(expected) and "Content-Encoding" not in response.headers:
+                    raise requests.exceptions.ChunkedEncodingError(f"Truncated response: {written} of {expected} bytes")
+                return response
+
+        except requests.RequestException as e:
+            retryable = not isinstance(e, requests.HTTPError) or e.response.status_code >= 500
+            if not retryable or attempt == retries:
+                raise
+            wait = float(pdok_setting("PDOK_RETRY_BACKOFF")) ** attempt
+            print(f"Download of {url} failed ({e}), retrying in {wait:.0f} s")
+            time.sleep(wait)
+
+
+def get_with_retries(url, params=None, retries=None):
+    """Same retry behaviour as download_to_file for small responses kept in memory."""
+    retries = int(pdok_setting("PDOK_RETRIES")) if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            response = requests.get(url, params=params, timeout=float(pdok_setting("PDOK_TIMEOUT")))
+            response.raise_for_status()
+
+            expected = response.headers.get("Content-Length")
+            if expected is not None and len(response.content) != int(expected) and "Content-Encoding" not in response.headers:
+                raise requests.exceptions.ChunkedEncodingError(f"Truncated response: {len(response.content)} of {expected} bytes")
+            return response
+
+        except requests.RequestException as e:
+            retryable = not isinstance(e, requests.HTTPError) or e.response.status_code >= 500
+            if not retryable or attempt == retries:
+                raise
+            wait = float(pdok_setting("PDOK_RETRY_BACKOFF")) ** attempt
+            print(f"Request to {url} failed ({e}), retrying in {wait:.0f} s")
+            time.sleep(wait)
@@ -0,0 +1,75 @@
+import os
+import time
+import socket
+import threading
+from contextlib import contextmanager
+
+
+def _break_stale_lock(lock_path, stale_seconds):
+    # Move the lock file aside before deleting it: only one waiter can move a given file, so
+    # two waiters that both saw the same stale lock cannot delete each other's fresh lock
+    broken_path = f"{lock_path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.broken"
+    try:
+        os.rename(lock_path, broken_path)
+    except FileNotFoundError:
+        return
+    if time.time() - os.path.getmtime(broken_path) > stale_seconds:
+        os.remove(broken_path)
+        return
+
+    # Another waiter broke the stale lock first and the moved file is a live lock; put it back
+    try:
+        os.link(broken_path, lock_path)
+    except FileExistsError:
+        print(f"Lock {lock_path} was taken while a live lock was moved aside")
+    os.remove(broken_path)
+
+
+@contextmanager
+def file_lock(lock_path, poll_seconds=0.5, stale_seconds=3600, blocking=True):
+    """
+    Exclusive lock based on creating a lock file, usable between threads, processes and
+    hosts that share the same filesystem. A lock file older than `stale_seconds` is
+    considered left behind by a crashed holder and is broken (see _break_stale_lock).
+
+    Parameters:
+    lock_path (str): Path of the lock file.
+    poll_seconds (float): Time to wait between attempts.
+    stale_seconds (float): Age after which an existing lock file is removed.
+    blocking (bool): Wait for the lock; otherwise give up at once when it is held.
+
+    Yields:
+    bool: True once the lock is held; False if `blocking` is off and the lock is held elsewhere.
+    """
+    lock_dir = os.path.dirname(lock_path)
+    if lock_dir:
+        os.makedirs(lock_dir, exist_ok=True)
+
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > stale_seconds:
+                    _break_stale_lock(lock_path, stale_seconds)
+                    continue
+            except FileNotFoundError:
+                continue
+            if not blocking:
+                yield False
+                return
+            time.sleep(poll_seconds)
+
+    try:
+        os.write(fd, f"{socket.gethostname()} {os.getpid()}\n".encode())
+        lock_inode = os.fstat(fd).st_ino
+        os.close(fd)
+        yield True
+    finally:
+        # Only remove the lock file if it is still ours and was not broken as stale meanwhile
+        try:
+            if os.stat(lock_path).st_ino == lock_inode:
+                os.remove(lock_path)
+        except FileNotFoundError:
+            pass
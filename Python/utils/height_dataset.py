@@ -0,0 +1,226 @@
+import os
+import json
+
+import pandas as pd
+import geopandas as gpd
+
+from .file_lock import file_lock
+from .height_index import ESTIMATED_HEIGHT_DIR
+
+# National building height dataset: one GeoParquet file per neighborhood, partitioned as
+# municipality=<name>/kaartblad=<suffix>/<neighborhood>.parquet. The partition index keeps
+# the bounding box (EPSG:4326) and row count of every file, so readers only open the files
+# that overlap their query area; inside a file the bbox covering column lets the reader skip
+# row groups outside the area.
+HEIGHT_DATASET_DIR = "output/building_heights"
+HEIGHT_DATASET_INDEX = f"{HEIGHT_DATASET_DIR}/_partitions.json"
+HEIGHT_DATASET_LOCK = f"{HEIGHT_DATASET_DIR}/_partitions.lock"
+KAARTBLADINDEX_PATH = "assets/kaartbladindex.json"
+MANIFEST_DIR = "data/manifests"
+
+
+def _partition_value(value):
+    # Partition values end up in folder names
+    return str(value).replace("/", "_").replace("=", "_").replace(" ", "_")
+
+
+def read_partition_index():
+    """Returns the partition index of the height dataset ({relative path: statistics})."""
+    if not os.path.exists(HEIGHT_DATASET_INDEX):
+        return {}
+    with open(HEIGHT_DATASET_INDEX, 'r') as f:
+        return json.load(f)
+
+
+def _write_partition_index(index):
+    tmp_path = f"{HEIGHT_DATASET_INDEX}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, HEIGHT_DATASET_INDEX)
+
+
+def assign_kaartblad(buildings_gdf, kaartblad_suffixes, kaartbladindex_gdf=None):
+    """
+    Returns the kaartblad sheet suffix of every building, by the sheet that contains its
+    representative point; buildings outside the given sheets get the first suffix.
+
+    Parameters:
+    buildings_gdf (GeoDataFrame): The buildings.
+    kaartblad_suffixes (list): Suffixes of the sheets the neighborhood was downloaded from.
+    kaartbladindex_gdf (GeoDataFrame, optional): The kaartblad index; read from assets/ if omitted.
+
+    Returns:
+    list: One kaartblad suffix per building.
+    """
+    if not kaartblad_suffixes:
+        return ["unknown"] * len(buildings_gdf)
+    if len(kaartblad_suffixes) == 1:
+        return [kaartblad_suffixes[0]] * len(buildings_gdf)
+
+    if kaartbladindex_gdf is None:
+        kaartbladindex_gdf = gpd.read_file(KAARTBLADINDEX_PATH)
+    sheets_gdf = kaartbladindex_gdf.assign(suffix=kaartbladindex_gdf['kaartbladNr'].str.split('_').str[1].str.lower())
+    sheets_gdf = sheets_gdf[sheets_gdf['suffix'].isin(kaartblad_suffixes)][['suffix', 'geometry']]
+
+    points_gdf = gpd.GeoDataFrame(geometry=buildings_gdf.geometry.representative_point(), crs=buildings_gdf.crs)
+    points_gdf = points_gdf.to_crs(sheets_gdf.crs)
+    joined = gpd.sjoin(points_gdf, sheets_gdf, how="left", predicate="within")
+    joined = joined[~joined.index.duplicated(keep="first")]
+    return joined['suffix'].fillna(kaartblad_suffixes[0]).tolist()
+
+
+def append_building_heights(buildings_gdf, mean_values, neighborhood_name, municipality, kaartblad_suffixes,
+                            extra_properties=None, kaartbladindex_gdf=None):
+    """
+    Writes the building heights of a neighborhood into the partitioned dataset, replacing
+    earlier results of the same neighborhood, and updates the partition index.
+
+    Parameters:
+    buildings_gdf (GeoDataFrame): The building footprints.
+    mean_values (list): Estimated height per footprint (None where unknown).
+    neighborhood_name (str): The neighborhood.
+    municipality (str): Municipality partition of the neighborhood.
+    kaartblad_suffixes (list): Kaartblad sheets of the neighborhood (see assign_kaartblad).
+    extra_properties (dict, optional): Additional per-footprint columns, keyed by column name.
+    kaartbladindex_gdf (GeoDataFrame, optional): The kaartblad index.
+
+    Returns:
+    list: Paths of the written partition files.
+    """
+    heights_gdf = gpd.GeoDataFrame({
+        "neighborhood": neighborhood_name,
+        "feature_id": range(len(buildings_gdf)),  # position in the neighborhood's footprints and GeoJSON
+        "MeanValue": pd.array(mean_values, dtype="Float64"),
+        **(extra_properties or {})
+    }, geometry=buildings_gdf.geometry.values, crs=buildings_gdf.crs)
+    heights_gdf["kaartblad"] = assign_kaartblad(heights_gdf, kaartblad_suffixes, kaartbladindex_gdf)
+    heights_gdf = heights_gdf.to_crs(epsg=4326)
+
+    written = {}
+    for kaartblad, partition_gdf in heights_gdf.groupby("kaartblad", sort=True):
+        relative_path = (f"municipality={_partition_value(municipality)}/kaartblad={_partition_value(kaartblad)}/"
+                         f"{_partition_value(neighborhood_name)}.parquet")
+        path = f"{HEIGHT_DATASET_DIR}/{relative_path}"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        partition_gdf.drop(columns="kaartblad").to_parquet(tmp_path, index=False, write_covering_bbox=True)
+        os.replace(tmp_path, path)
+
+        xmin, ymin, xmax, ymax = partition_gdf.total_bounds
+        written[relative_path] = {
+            "municipality": municipality,
+            "kaartblad": kaartblad,
+            "neighborhood": neighborhood_name,
+            "bbox": [float(xmin), float(ymin), float(xmax), float(ymax)],
+            "rows": len(partition_gdf)
+        }
+
+    # Sharded workers append concurrently, so the index is updated under a file lock
+    os.makedirs(HEIGHT_DATASET_DIR, exist_ok=True)
+    with file_lock(HEIGHT_DATASET_LOCK):
+        index = read_partition_index()
+        for relative_path, entry in list(index.items()):
+            # A rerun may assign the neighborhood to other partitions; drop its stale files
+            if entry["neighborhood"] == neighborhood_name and relative_path not in written:
+                stale_path = f"{HEIGHT_DATASET_DIR}/{relative_path}"
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+                del index[relative_path]
+        index.update(written)
+        _write_partition_index(index)
+
+    print(f"{neighborhood_name} added to the building height dataset ({len(written)} partition(s))")
+    return [f"{HEIGHT_DATASET_DIR}/{relative_path}" for relative_path in written]
+
+
+def import_existing_building_heights(directory=ESTIMATED_HEIGHT_DIR):
+    """
+    One-off import of building height GeoJSONs computed before the dataset existed: every
+    neighborhood in `directory` that is not in the dataset yet is appended, partitioned by
+    the municipality and kaartblad sheets of its manifest in data/manifests/ ('unknown'
+    without a manifest).
+
+    Parameters:
+    directory (str): Folder with the per-neighborhood building height GeoJSONs.
+
+    Returns:
+    list: The neighborhoods that were imported.
+    """
+    if not os.path.exists(directory):
+        return []
+
+    known = set(list_dataset_neighborhoods())
+    imported = []
+    kaartbladindex_gdf = None
+    for file_name in sorted(os.listdir(directory)):
+        neighborhood_name, extension = os.path.splitext(file_name)
+        if extension != ".json" or neighborhood_name in known:
+            continue
+
+        manifest_path = f"{MANIFEST_DIR}/{neighborhood_name}.json"
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+        kaartblad_suffixes = manifest.get("kaartblad", [])
+        if len(kaartblad_suffixes) > 1 and kaartbladindex_gdf is None:
+            kaartbladindex_gdf = gpd.read_file(KAARTBLADINDEX_PATH)
+
+        buildings_gdf = gpd.read_file(os.path.join(directory, file_name))
+        extra_properties = {column: buildings_gdf[column].tolist() for column in buildings_gdf.columns
+                            if column not in ("MeanValue", "geometry")}
+        append_building_heights(buildings_gdf, buildings_gdf["MeanValue"].tolist(), neighborhood_name,
+                                "+".join(manifest.get("municipality", [])) or "unknown", kaartblad_suffixes,
+                                extra_properties, kaartbladindex_gdf)
+        imported.append(neighborhood_name)
+
+    if imported:
+        print(f"{len(imported)} existing neighborhood(s) imported into the building height dataset")
+    return imported
+
+
+def list_dataset_neighborhoods():
+    """Returns the names of the neighborhoods in the height dataset."""
+    return sorted({entry["neighborhood"] for entry in read_partition_index().values()})
+
+
+def read_building_heights(bbox=None, columns=None, municipalities=None, neighborhoods=None):
+    """
+    Reads building heights from the partitioned dataset. Only the partition files whose
+    bounding box overlaps `bbox` and that match the name filters are opened, and only the
+    requested columns are read.
+
+    Parameters:
+    bbox (tuple, optional): (minx, miny, maxx, maxy) in EPSG:4326.
+    columns (list, optional): Columns to read besides the geometry (default: all).
+    municipalities (list, optional): Only read these municipalities.
+    neighborhoods (list, optional): Only read these neighborhoods.
+
+    Returns:
+    GeoDataFrame: The buildings in EPSG:4326, ordered by neighborhood and feature_id.
+    """
+    paths = []
+    for relative_path, entry in sorted(read_partition_index().items()):
+        if municipalities is not None and entry["municipality"] not in municipalities:
+            continue
+        if neighborhoods is not None and entry["neighborhood"] not in neighborhoods:
+            continue
+        if bbox is not None:
+            xmin, ymin, xmax, ymax = entry["bbox"]
+            if xmin > bbox[2] or xmax < bbox[0] or ymin > bbox[3] or ymax < bbox[1]:
+                continue
+        paths.append(f"{HEIGHT_DATASET_DIR}/{relative_path}")
+
+    if columns is not None:
+        # The sort keys are always read
+        columns = list(dict.fromkeys(["neighborhood", "feature_id"] + list(columns) + ["geometry"]))
+
+    frames = [gpd.read_parquet(path, columns=columns, bbox=bbox) for path in paths]
+    frames = [frame.drop(columns="bbox", errors="ignore") for frame in frames if not frame.empty]
+    if not frames:
+        return gpd.GeoDataFrame(columns=columns or ["neighborhood", "feature_id", "MeanValue", "geometry"],
+                                geometry="geometry", crs="EPSG:4326")
+
+    heights_gdf = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=frames[0].crs)
+    return heights_gdf.sort_values(["neighborhood", "feature_id"], ignore_index=True)
@@ -0,0 +1,148 @@
+import os
+import json
+import threading
+
+import numpy as np
+import shapely
+from shapely import STRtree
+from shapely.geometry import shape
+
+ESTIMATED_HEIGHT_DIR = "output/estimated_building_height"
+
+
+class BuildingHeightIndex:
+    """
+    In-memory, R-tree indexed store of all estimated building heights in
+    output/estimated_building_height/, for batched point and bbox lookups (EPSG:4326).
+
+    Heights are kept in one float32 array next to the footprints; `refresh()` only
+    parses neighborhood files that are new or changed since the last load.
+    """
+
+    def __init__(self, directory=ESTIMATED_HEIGHT_DIR):
+        self.directory = directory
+        self._files = {}  # neighborhood name -> (mtime, geometries, heights)
+        self._failed = {}  # neighborhood name -> mtime of a file that could not be loaded
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self.refresh()
+
+    @staticmethod
+    def _load_file(path):
+        with open(path, 'r') as f:
+            features = json.load(f)["features"]
+        geometries = np.array([shape(feature["geometry"]) for feature in features], dtype=object)
+        heights = np.array([np.nan if feature["properties"].get("MeanValue") is None else feature["properties"]["MeanValue"]
+                            for feature in features], dtype=np.float32)
+        return geometries, heights
+
+    def refresh(self):
+        """
+        Loads neighborhoods that were added or changed and drops removed ones.
+
+        Returns:
+        list: Names of the neighborhoods that were (re)loaded.
+        """
+        with self._lock:
+            current = {}
+            if os.path.exists(self.directory):
+                for file_name in os.listdir(self.directory):
+                    if file_name.endswith(".json"):
+                        try:
+                            current[file_name[:-len(".json")]] = os.path.getmtime(os.path.join(self.directory, file_name))
+                        except FileNotFoundError:
+                            continue  # Removed since it was listed
+
+            reloaded = [name for name, mtime in current.items()
+                        if (name not in self._files or self._files[name][0] != mtime) and self._failed.get(name) != mtime]
+            removed = [name for name in self._files if name not in current]
+            if not reloaded and not removed and self._snapshot is not None:
+                return []
+
+            for name in removed:
+                del self._files[name]
+            for name in [name for name in self._failed if name not in current]:
+                del self._failed[name]
+            failed = []
+            for name in reloaded:
+                try:
+                    geometries, heights = self._load_file(os.path.join(self.directory, f"{name}.json"))
+                except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                    # One bad file must not take the index down; keep serving its previous version, if any
+                    print(f"Building height index: skipping {name} until it changes: {e}")
+                    self._failed[name] = current[name]
+                    failed.append(name)
+                    continue
+                self._failed.pop(name, None)
+                self._files[name] = (current[name], geometries, heights)
+            reloaded = [name for name in reloaded if name not in failed]
+
+            # Build the new index aside and swap it in, so queries never see a half-built index
+            names = sorted(self._files)
+            geometries = np.concatenate([self._files[name][1] for name in names]) if names else np.empty(0, dtype=object)
+            heights = np.concatenate([self._files[name][2] for name in names]) if names else np.empty(0, dtype=np.float32)
+            name_ids = np.concatenate([np.full(len(self._files[name][2]), i, dtype=np.int32) for i, name in enumerate(names)]) if names else np.empty(0, dtype=np.int32)
+            feature_ids = np.concatenate([np.arange(len(self._files[name][2]), dtype=np.int32) for name in names]) if names else np.empty(0, dtype=np.int32)
+            self._snapshot = (STRtree(geometries), names, geometries, heights, name_ids, feature_ids)
+
+        if reloaded or removed:
+            print(f"Building height index: {len(reloaded)} neighborhoods loaded, {len(removed)} removed, {len(heights)} buildings in total")
+        return reloaded
+
+    def __len__(self):
+        return len(self._snapshot[3])
+
+    @staticmethod
+    def _record(snapshot, i, with_geometry=False):
+        _, names, geometries, heights, name_ids, feature_ids = snapshot
+        record = {
+            "neighborhood": names[name_ids[i]],
+            "feature": int(feature_ids[i]),
+            "height": None if np.isnan(heights[i]) else float(heights[i])
+        }
+        if with_geometry:
+            record["geometry"] = geometries[i].__geo_interface__
+        return record
+
+    def query_points(self, lons, lats):
+        """
+        Looks up the building at each point.
+
+        Parameters:
+        lons (array-like), lats (array-like): Point coordinates in EPSG:4326.
+
+        Returns:
+        list: One record (neighborhood, feature, height) per point, None where no building is hit.
+        """
+        snapshot = self._snapshot
+        results = [None] * len(lons)
+        if len(results) == 0:
+            return results
+
+        point_ids, building_ids = snapshot[0].query(shapely.points(lons, lats), predicate="intersects")
+        for point_id, building_id in zip(point_ids, building_ids):
+            if results[point_id] is None:
+                results[point_id] = self._record(snapshot, building_id)
+        return results
+
+    def query_bboxes(self, bboxes, with_geometry=False):
+        """
+        Lists all buildings intersecting each bounding box.
+
+        Parameters:
+        bboxes (list): (minx, miny, maxx, maxy) tuples in EPSG:4326.
+        with_geometry (bool): Include the footprints as GeoJSON geometries.
+
+        Returns:
+        list: One list of building records per bounding box.
+        """
+        snapshot = self._snapshot
+        results = [[] for _ in bboxes]
+        if len(results) == 0:
+            return results
+
+        boxes = shapely.box(*np.asarray(bboxes, dtype=np.float64).T)
+        box_ids, building_ids = snapshot[0].query(boxes, predicate="intersects")
+        for box_id, building_id in zip(box_ids, building_ids):
+            results[box_id].append(self._record(snapshot, building_id, with_geometry))
+        return results
@@ -0,0 +1,192 @@
+import os
+import math
+import hashlib
+
+import numpy as np
+import rasterio
+import shapely
+from rasterio.features import rasterize
+
+# Cache of building-ID rasters. A label raster holds, for every CHM pixel, 1 + the index of
+# the footprint whose interior contains the pixel centre (0 = no building). It only depends
+# on the footprints and the grid, so it is reused for every later statistics run on that grid.
+# Overlapping footprints are spread over extra layers, because a layer can give a pixel to one
+# footprint only while rasterstats counts it for every footprint that contains its centre.
+LABEL_CACHE_DIR = "data/label_cache"
+LABEL_CACHE_VERSION = 2  # Bumped when the content of the label rasters changes
+
+
+def footprint_fingerprint(footprints_gdf):
+    """Returns a SHA-256 fingerprint of the footprint geometries, their order and their CRS."""
+    digest = hashlib.sha256()
+    digest.update(str(footprints_gdf.crs).encode())
+    for geometry in footprints_gdf.geometry:
+        digest.update(geometry.wkb if geometry is not None else b'')
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+def grid_fingerprint(transform, shape, crs):
+    """Returns a SHA-256 fingerprint of a raster grid definition (transform, shape and CRS)."""
+    grid_definition = f"{tuple(round(v, 9) for v in transform[:6])}|{tuple(shape)}|{crs}"
+    return hashlib.sha256(grid_definition.encode()).hexdigest()
+
+
+def label_layers(footprints_gdf):
+    """
+    Assigns every footprint to a layer of the label raster, so that no two footprints whose
+    interiors overlap share a layer (footprints that only share an edge may). Most footprints
+    end up in layer 0; the others are spread greedily over as few extra layers as possible.
+
+    Parameters:
+    footprints_gdf (GeoDataFrame): The building footprints.
+
+    Returns:
+    ndarray: The layer of every footprint.
+    """
+    layers = np.zeros(len(footprints_gdf), dtype=np.int64)
+    if len(footprints_gdf) == 0:
+        return layers
+
+    geometries = np.asarray(footprints_gdf.geometry.values, dtype=object)
+    left, right = footprints_gdf.sindex.query(geometries, predicate="intersects")
+    pairs = left != right
+    left, right = left[pairs], right[pairs]
+    interiors_overlap = shapely.relate_pattern(geometries[left], geometries[right], "T********")
+    left, right = left[interiors_overlap], right[interiors_overlap]
+
+    # The pairs come in both directions; every footprint avoids the layers of the overlapping footprints before it
+    order = np.argsort(left, kind="stable")
+    left, right = left[order], right[order]
+    starts = np.searchsorted(left, np.arange(len(footprints_gdf) + 1))
+    for i in np.unique(left):
+        neighbours = right[starts[i]:starts[i + 1]]
+        used = set(layers[neighbours[neighbours < i]].tolist())
+        layer = 0
+        while layer in used:
+            layer += 1
+        layers[i] = layer
+    return layers
+
+
+def pixel_window(bounds, transform, shape):
+    """
+    Returns the pixel window (row_start, row_stop, col_start, col_stop) that covers a
+    bounding box on a north-up grid, clipped to the grid; the window is empty if the box
+    lies outside the grid.
+    """
+    xmin, ymin, xmax, ymax = bounds
+    rows, cols = shape
+    col_start = max(int(math.floor((xmin - transform.c) / transform.a)), 0)
+    col_stop = min(int(math.ceil((xmax - transform.c) / transform.a)), cols)
+    row_start = max(int(math.floor((ymax - transform.f) / transform.e)), 0)
+    row_stop = min(int(math.ceil((ymin - transform.f) / transform.e)), rows)
+    return row_start, max(row_stop, row_start), col_start, max(col_stop, col_start)
+
+
+def rasterize_labels(geometries, ids, layers, transform, shape, dtype):
+    """
+    Rasterises footprints into a stack of label rasters, one per layer.
+
+    Parameters:
+    geometries (list): The footprints.
+    ids (list): The label of every footprint (> 0).
+    layers (list): The layer of every footprint (see label_layers).
+    transform (Affine): Transform of the grid.
+    shape (tuple): (rows, cols) of the grid.
+    dtype: Integer type of the labels.
+
+    Returns:
+    ndarray: Label rasters of shape (layers, rows, cols).
+    """
+    n_layers = int(max(layers, default=0)) + 1
+    labels = np.zeros((n_layers,) + tuple(shape), dtype=dtype)
+    for layer in range(n_layers):
+        shapes = [(geometry, label) for geometry, label, geometry_layer in zip(geometries, ids, layers)
+                  if geometry_layer == layer and geometry is not None and not geometry.is_empty]
+        if shapes:
+            labels[layer] = rasterize(shapes, out_shape=shape, transform=transform, fill=0, all_touched=False, dtype=dtype)
+    return labels
+
+
+def label_raster(footprints_gdf, transform, shape, crs):
+    """
+    Returns the building-ID rasters of footprints on a grid, from the cache if they were
+    rasterised before. Pixels are assigned by their centre, like rasterstats does.
+    Overlapping footprints are put in separate layers, so a pixel counts for every
+    footprint that contains its centre.
+
+    Parameters:
+    footprints_gdf (GeoDataFrame): The building footprints, in the CRS of the grid.
+    transform (Affine): Transform of the grid.
+    shape (tuple): (rows, cols) of the grid.
+    crs: CRS of the grid.
+
+    Returns:
+    ndarray: The label rasters (uint16 or uint32) of shape (layers, rows, cols).
+    """
+    key = hashlib.sha256((footprint_fingerprint(footprints_gdf) + grid_fingerprint(transform, shape, crs)
+                          + f"|v{LABEL_CACHE_VERSION}").encode()).hexdigest()
+    cache_path = f"{LABEL_CACHE_DIR}/{key}.npz"
+
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            return cached["labels"]
+
+    # The smallest integer type that can hold every building ID keeps the cache compact
+    dtype = np.uint16 if len(footprints_gdf) < np.iinfo(np.uint16).max else np.uint32
+    labels = rasterize_labels(list(footprints_gdf.geometry), range(1, len(footprints_gdf) + 1),
+                              label_layers(footprints_gdf), transform, shape, dtype)
+
+    os.makedirs(LABEL_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{LABEL_CACHE_DIR}/{key}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp_path, labels=labels)
+    os.replace(tmp_path, cache_path)
+    return labels
+
+
+def zonal_means_from_labels(data, labels, n_features, nodata=None):
+    """
+    Computes the mean raster value per building from a label raster.
+
+    Parameters:
+    data (ndarray): The raster values (e.g. the CHM).
+    labels (ndarray): The label raster of the same shape, or a stack of label rasters (see label_raster).
+    n_features (int): Number of footprints the labels refer to.
+    nodata (float, optional): Raster value to ignore, like rasterstats does.
+
+    Returns:
+    list: Mean value per footprint, None where a footprint covers no valid pixel.
+    """
+    valid_data = ~np.isnan(data)
+    if nodata is not None:
+        valid_data &= data != nodata
+
+    counts = np.zeros(n_features + 1, dtype=np.int64)
+    sums = np.zeros(n_features + 1, dtype=np.float64)
+    for layer_labels in labels.reshape((-1,) + data.shape):
+        valid = (layer_labels > 0) & valid_data
+        valid_labels = layer_labels[valid]
+        counts += np.bincount(valid_labels, minlength=n_features + 1)
+        sums += np.bincount(valid_labels, weights=data[valid].astype(np.float64), minlength=n_features + 1)
+
+    return [float(sums[i] / counts[i]) if counts[i] > 0 else None for i in range(1, n_features + 1)]
+
+
+def building_zonal_means(footprints_gdf, raster_path):
+    """
+    Mean raster value per building footprint, using a cached label raster instead of
+    rasterising the footprints again on every run. Overlapping footprints each get all the
+    pixels they contain, so the result matches rasterstats.zonal_stats.
+
+    Parameters:
+    footprints_gdf (GeoDataFrame): The building footprints.
+    raster_path (str): Path to the raster (e.g. the CHM).
+
+    Returns:
+    list: Mean value per footprint, None where a footprint covers no valid pixel.
+    """
+    with rasterio.open(raster_path) as raster:
+        data = raster.read(1)
+        labels = label_raster(footprints_gdf, raster.transform, raster.shape, raster.crs)
+        return zonal_means_from_labels(data, labels, len(footprints_gdf), raster.nodata)
@@ -0,0 +1,117 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import rasterio
+from affine import Affine
+from shapely import from_wkb
+
+from .label_cache import label_layers, pixel_window, rasterize_labels, zonal_means_from_labels
+
+# Intra-area parallel zonal statistics: the raster is read once into shared memory, the
+# footprints are cut into spatial strips and every worker process rasterises its strips
+# only inside their own window of a zero-copy view of the shared raster. Overlapping
+# footprints get the same label layers as in label_cache, so the results are identical.
+STRIPS_PER_WORKER = 4
+
+# Shared raster of a worker process, attached once by its initializer
+_shared_raster = None
+
+
+def _attach_shared_raster(name, shape, dtype):
+    global _shared_raster
+    # Pool workers share the resource tracker of the parent, which registered the block once and unlinks it
+    shm = shared_memory.SharedMemory(name=name)
+    _shared_raster = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def _strip_means(indices, geometries_wkb, layers, transform, nodata):
+    # Mean raster value of the footprints of one strip, from the window they cover
+    _, data = _shared_raster
+    transform = Affine(*transform)
+    geometries = from_wkb(geometries_wkb)
+    bounds = np.array([geometry.bounds for geometry in geometries if geometry is not None and not geometry.is_empty])
+    if bounds.size == 0:
+        return indices, [None] * len(indices)
+
+    row_start, row_stop, col_start, col_stop = pixel_window(
+        (bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()), transform, data.shape)
+    if row_stop == row_start or col_stop == col_start:
+        return indices, [None] * len(indices)
+
+    window = data[row_start:row_stop, col_start:col_stop]
+    window_transform = transform * Affine.translation(col_start, row_start)
+    dtype = np.uint16 if len(geometries) < np.iinfo(np.uint16).max else np.uint32
+    labels = rasterize_labels(geometries, range(1, len(geometries) + 1), layers, window_transform, window.shape, dtype)
+    return indices, zonal_means_from_labels(window, labels, len(geometries), nodata)
+
+
+def spatial_strips(footprints_gdf, n_strips):
+    """
+    Splits the footprints into `n_strips` strips of about equal size along the x-axis, so
+    every strip covers a narrow window of the raster.
+
+    Returns:
+    list: Arrays with the positions of the footprints of each strip.
+    """
+    centroids_x = footprints_gdf.geometry.bounds[["minx", "maxx"]].mean(axis=1).fillna(0).values
+    order = np.argsort(centroids_x, kind="stable")
+    return [strip for strip in np.array_split(order, max(min(n_strips, len(order)), 1)) if strip.size]
+
+
+def parallel_zonal_means(footprints_gdf, raster_path, workers=None):
+    """
+    Mean raster value per building footprint, computed by `workers` processes that share
+    one copy of the raster. Pixels are assigned by their centre, like rasterstats and the
+    label rasters do.
+
+    Parameters:
+    footprints_gdf (GeoDataFrame): The building footprints, in the CRS of the raster.
+    raster_path (str): Path to the raster (e.g. the CHM).
+    workers (int, optional): Number of worker processes (default: the number of CPUs).
+
+    Returns:
+    list: Mean value per footprint in the original order, None where a footprint covers no valid pixel.
+    """
+    workers = workers or os.cpu_count() or 1
+    mean_values = [None] * len(footprints_gdf)
+    strips = spatial_strips(footprints_gdf, workers * STRIPS_PER_WORKER)
+    if not strips:
+        return mean_values
+
+    # The layers are assigned over all footprints, so overlaps across strip borders are handled too
+    layers = label_layers(footprints_gdf)
+    geometries_wkb = np.array([geometry.wkb if geometry is not None else None for geometry in footprints_gdf.geometry],
+                              dtype=object)
+
+    with rasterio.open(raster_path) as raster:
+        transform = tuple(raster.transform)[:6]
+        nodata = raster.nodata
+        dtype = np.dtype(raster.dtypes[0])
+        shape = raster.shape
+
+        # One cleanup for the whole lifetime of the block: the view is released before the
+        # block is closed and unlinked, whether reading, the pool or a worker fails
+        shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        shared_data = None
+        try:
+            # Read the raster straight into the shared block, without an intermediate copy
+            shared_data = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            raster.read(1, out=shared_data)
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach_shared_raster,
+                                     initargs=(shm.name, shape, dtype.str)) as executor:
+                futures = [executor.submit(_strip_means, strip, list(geometries_wkb[strip]), layers[strip].tolist(), transform, nodata)
+                           for strip in strips]
+                # Merge the partial results back into the original feature order
+                for future in futures:
+                    indices, strip_means = future.result()
+                    for i, mean_value in zip(indices, strip_means):
+                        mean_values[i] = mean_value
+        finally:
+            shared_data = None
+            shm.close()
+            shm.unlink()
+
+    return mean_values
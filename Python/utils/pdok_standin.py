@@ -0,0 +1,260 @@
+import io
+import os
+import re
+import json
+import time
+import random
+import zlib
+import zipfile
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import box
+from osgeo import gdal, osr
+gdal.UseExceptions()
+
+# Synthetic world served by the stand-in: one square building in the middle of every
+# BLOCK x BLOCK metres, on a smoothly varying terrain. DSM, DTM and building statistics
+# are all derived from the same functions, so downloads of any extent fit together.
+BLOCK = 40.0
+BUILDING_MARGIN = 10.0
+AHN_NODATA = 3.4028234663852886e+38
+KAARTBLADINDEX_PATH = "assets/kaartbladindex.json"
+
+
+def _terrain(x, y):
+    return 7 + 2 * np.sin(x / 700.0) + 2 * np.cos(y / 900.0)
+
+
+def _block_height(bx, by):
+    # Deterministic building height between 4 and 20 m per block
+    return 4 + ((np.asarray(bx, dtype=np.int64) * 73856093 ^ np.asarray(by, dtype=np.int64) * 19349663) % 161) / 10.0
+
+
+def _in_building(x, y):
+    return ((x % BLOCK >= BUILDING_MARGIN) & (x % BLOCK < BLOCK - BUILDING_MARGIN)
+            & (y % BLOCK >= BUILDING_MARGIN) & (y % BLOCK < BLOCK - BUILDING_MARGIN))
+
+
+def synthetic_coverage(coverage_id, bbox, resx, resy):
+    """
+    Renders the synthetic DSM ('dsm_05m') or DTM ('dtm_05m') of a bounding box as GeoTIFF bytes.
+    The DTM has no data under the buildings, like the AHN DTM.
+    """
+    xmin, ymin, xmax, ymax = bbox
+    cols = max(int(round((xmax - xmin) / resx)), 1)
+    rows = max(int(round((ymax - ymin) / resy)), 1)
+    x = (xmin + (np.arange(cols) + 0.5) * resx)[np.newaxis, :]
+    y = (ymax - (np.arange(rows) + 0.5) * resy)[:, np.newaxis]
+
+    terrain = _terrain(x, y) + np.zeros((rows, cols))
+    buildings = _in_building(x, y)
+    if coverage_id.startswith("dsm"):
+        data = terrain + np.where(buildings, _block_height(np.floor(x / BLOCK), np.floor(y / BLOCK)), 0)
+    else:
+        data = np.where(buildings, AHN_NODATA, terrain)
+
+    path = f"/vsimem/standin_{threading.get_ident()}.tif"
+    ds = gdal.GetDriverByName('GTiff').Create(path, cols, rows, 1, gdal.GDT_Float32)
+    ds.SetGeoTransform((xmin, resx, 0, ymax, 0, -resy))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(28992)
+    ds.SetProjection(srs.ExportToWkt())
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(AHN_NODATA)
+    band.WriteArray(data.astype(np.float32))
+    ds = None
+
+    f = gdal.VSIFOpenL(path, 'rb')
+    gdal.VSIFSeekL(f, 0, 2)
+    size = gdal.VSIFTellL(f)
+    gdal.VSIFSeekL(f, 0, 0)
+    content = gdal.VSIFReadL(1, size, f)
+    gdal.VSIFCloseL(f)
+    gdal.Unlink(path)
+    return content
+
+
+def synthetic_boundaries(buurtcodes):
+    """Returns GeoJSON (EPSG:28992) with a 240 m square neighborhood near Wageningen per buurtcode."""
+    features = []
+    for code in buurtcodes:
+        h = zlib.crc32(code.encode())
+        x = 172000 + (h % 40) * 250
+        y = 440000 + ((h // 40) % 40) * 250
+        features.append({
+            "type": "Feature",
+            "geometry": box(x, y, x + 240, y + 240).__geo_interface__,
+            "properties": {"buurtcode": code, "buurtnaam": f"Synthetic {code}"}
+        })
+    return json.dumps({
+        "type": "FeatureCollection",
+        "crs": {"type": "name", "properties": {"name": "urn:ogc:def:crs:EPSG::28992"}},
+        "features": features
+    }).encode()
+
+
+def synthetic_building_archive(suffix):
+    """Returns the zip bytes of a kaartblad building-statistics archive with the synthetic buildings of the sheet."""
+    sheet_bounds = None
+    if os.path.exists(KAARTBLADINDEX_PATH):
+        kaartbladindex_gdf = gpd.read_file(KAARTBLADINDEX_PATH)
+        matches = kaartbladindex_gdf[kaartbladindex_gdf['kaartbladNr'].str.split('_').str[1].str.lower() == suffix]
+        if not matches.empty:
+            sheet_bounds = matches.to_crs(epsg=28992).total_bounds
+    if sheet_bounds is None:
+        sheet_bounds = (170000, 440000, 175000, 446250)
+
+    xmin, ymin, xmax, ymax = sheet_bounds
+    bx, by = np.meshgrid(np.arange(np.floor(xmin / BLOCK), np.ceil(xmax / BLOCK)),
+                         np.arange(np.floor(ymin / BLOCK), np.ceil(ymax / BLOCK)))
+    bx, by = bx.ravel(), by.ravel()
+    ground = _terrain(bx * BLOCK + BLOCK / 2, by * BLOCK + BLOCK / 2)
+
+    buildings_gdf = gpd.GeoDataFrame({
+        "identificatie": [f"NL.SYNTHETIC.{int(x)}.{int(y)}" for x, y in zip(bx, by)],
+        "h_maaiveld": ground,
+        "dd_h_dak_m": ground + _block_height(bx, by),
+        "geometry": [box(x * BLOCK + BUILDING_MARGIN, y * BLOCK + BUILDING_MARGIN,
+                         (x + 1) * BLOCK - BUILDING_MARGIN, (y + 1) * BLOCK - BUILDING_MARGIN) for x, y in zip(bx, by)]
+    }, crs="EPSG:28992")
+
+    gpkg_name = f"{suffix}_2020_hoogtestatistieken_gebouwen.gpkg"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gpkg_path = os.path.join(tmp_dir, gpkg_name)
+        buildings_gdf.to_file(gpkg_path, driver="GPKG")
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+            zip_ref.write(gpkg_path, gpkg_name)
+    return buffer.getvalue()
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    standin = None
+
+    def do_GET(self):
+        standin = self.standin
+        standin._count("requests")
+        url = urlparse(self.path)
+        query = {key.lower(): values[0] for key, values in parse_qs(url.query).items()}
+
+        if standin.latency:
+            time.sleep(standin.latency)
+        if standin._roll(standin.error_rate):
+            standin._count("errors")
+            self.send_error(503, "Injected error")
+            return
+
+        if url.path == "/wfs":
+            buurtcodes = re.findall(r"<Literal>(.*?)</Literal>", query.get("filter", ""))
+            self._send(synthetic_boundaries(buurtcodes), "application/json")
+        elif url.path == "/wcs" and query.get("request", "").lower() == "getcoverage":
+            bbox = tuple(float(value) for value in query["bbox"].split(","))
+            self._send(synthetic_coverage(query["coverage"], bbox, float(query["resx"]), float(query["resy"])), "image/tiff")
+        elif url.path.startswith("/download/") and url.path.endswith("_2020_hoogtestatistieken_gebouwen.zip"):
+            suffix = os.path.basename(url.path).split("_")[0]
+            self._send(standin._archive(suffix), "application/zip")
+        else:
+            self.send_error(404, "Unknown stand-in endpoint")
+
+    def _send(self, body, content_type):
+        standin = self.standin
+        truncate = standin._roll(standin.truncate_rate)
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if truncate:
+            standin._count("truncated")
+            body = body[:len(body) // 2]
+            self.close_connection = True
+
+        # Throttle to the configured throughput
+        chunk_size = 64 * 1024
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            try:
+                self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            standin._count("bytes", len(chunk))
+            if standin.bandwidth:
+                time.sleep(len(chunk) / standin.bandwidth)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PDOKStandIn:
+    """
+    Local stand-in for the three PDOK endpoints (wijkenbuurten WFS, AHN WCS and the
+    basisvoorziening-3d downloads) serving synthetic responses, with injectable latency,
+    throughput cap, error rate and truncated responses.
+
+    Point the pipeline at it by exporting the variables in `environment()` before starting
+    a run (the endpoints are read when `utils` is imported).
+
+    Parameters:
+    host (str), port (int): Address to listen on (port 0 picks a free port).
+    latency (float): Seconds to wait before answering each request.
+    bandwidth (float, optional): Throughput cap per response in bytes per second.
+    error_rate (float): Share of requests answered with HTTP 503.
+    truncate_rate (float): Share of responses cut off halfway.
+    seed (int, optional): Seed of the fault injection, for reproducible runs.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8010, latency=0.0, bandwidth=None, error_rate=0.0, truncate_rate=0.0, seed=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.stats = {"requests": 0, "errors": 0, "truncated": 0, "bytes": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._archive_lock = threading.Lock()
+        self._archives = {}
+
+        handler = type("StandInHandler", (_StandInHandler,), {"standin": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = None
+
+    def _roll(self, rate):
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _archive(self, suffix):
+        # Archives are generated once per sheet and then served from memory
+        with self._archive_lock:
+            if suffix not in self._archives:
+                self._archives[suffix] = synthetic_building_archive(suffix)
+            return self._archives[suffix]
+
+    def environment(self):
+        """Returns the environment variables that point the endpoints at this stand-in."""
+        base_url = f"http://{self.host}:{self.port}"
+        return {
+            "PDOK_WFS_URL": f"{base_url}/wfs",
+            "PDOK_WCS_URL": f"{base_url}/wcs",
+            "PDOK_DOWNLOAD_URL": f"{base_url}/download"
+        }
+
+    def start(self):
+        """Serves in a background thread and returns self."""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
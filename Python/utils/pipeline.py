@@ -0,0 +1,343 @@
+import os
+import json
+import glob
+import queue
+import shutil
+import threading
+
+import geopandas as gpd
+from rasterstats import zonal_stats
+
+from .data_download import download_neighborhood_data, find_matching_index, download_and_extract_building_boundaries
+from .archive_store import release_kaartblad_archives, evict_kaartblad_archives
+from .tile_store import read_store_window, tile_indices_for_bbox, ensure_raw_tiles
+from .label_cache import building_zonal_means
+from .height_dataset import append_building_heights
+from .parallel_zonal import parallel_zonal_means
+
+RECORDS_PATH = 'data/nl_records.txt'
+MANIFEST_DIR = 'data/manifests'
+PREVIEW_MANIFEST_DIR = f'{MANIFEST_DIR}/preview'
+
+
+def neighborhood_jobs(buurten_gdf, municipality, neighborhood_names=None):
+    """
+    Turns a municipality and a selection of its neighborhoods into one job per neighborhood.
+
+    Parameters:
+    buurten_gdf (GeoDataFrame): GeoDataFrame containing municipality and neighborhood data.
+    municipality (str): Name of the municipality (case sensitive).
+    neighborhood_names (list, optional): Neighborhood names; all neighborhoods of the municipality if omitted.
+
+    Returns:
+    list: (filtered_nl_gdf, neighborhood_name) tuples.
+    """
+    filtered_buurten_gdf = buurten_gdf[buurten_gdf["gm_naam"] == municipality]
+    if neighborhood_names is None:
+        neighborhood_names = sorted(filtered_buurten_gdf['bu_naam'].unique())
+
+    jobs = []
+    for neighborhood in neighborhood_names:
+        filtered_nl_gdf = filtered_buurten_gdf[filtered_buurten_gdf['bu_naam'] == neighborhood]
+        if not filtered_nl_gdf.empty:
+            jobs.append((filtered_nl_gdf, neighborhood.replace(" ", "_")))
+    return jobs
+
+
+def record_neighborhood(neighborhood_name):
+    """Appends a finished neighborhood to data/nl_records.txt for vis.py."""
+    with open(RECORDS_PATH, 'a') as file:
+        file.write(neighborhood_name + '\n')
+
+
+def read_manifest(neighborhood_name, manifest_dir=MANIFEST_DIR):
+    """Returns the manifest written by the download stage (or, with PREVIEW_MANIFEST_DIR, the preview) of a neighborhood, or None."""
+    manifest_path = f"{manifest_dir}/{neighborhood_name}.json"
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def download_stage(filtered_nl_gdf, neighborhood_name, kaartbladindex_gdf, buurten_gdf=None):
+    """
+    Downloads everything a neighborhood needs: its boundary, its building boundaries and the
+    raw DSM/DTM of the tile store tiles it touches. A manifest with the selection, bounding box and
+    kaartblad sheets is saved under data/manifests/. The kaartblad sheets
+    selected by an earlier preview of the same selection are reused.
+
+    Parameters:
+    filtered_nl_gdf (GeoDataFrame): The selected neighborhoods.
+    neighborhood_name (str): The name used for all files of this job.
+    kaartbladindex_gdf (GeoDataFrame): The kaartblad index.
+    buurten_gdf (GeoDataFrame, optional): All neighborhoods, used to prefetch boundaries of the municipality.
+
+    Returns:
+    str: The neighborhood name.
+    """
+    # Make sure directories exist
+    for directory in ['data/boundary_nl', MANIFEST_DIR]:
+        os.makedirs(directory, exist_ok=True)
+
+    # Download neighborhood boundary data to geojson
+    nl_boundary_gdf = download_neighborhood_data(filtered_nl_gdf, neighborhood_name, buurten_gdf)
+    if nl_boundary_gdf is None:
+        raise RuntimeError(f"No neighborhood boundary available for {neighborhood_name}")
+
+    # Convert the input neighborhood to existing kaartbladindex and download its building boundaries
+    preview_manifest = read_manifest(neighborhood_name, PREVIEW_MANIFEST_DIR)
+    if preview_manifest is not None and preview_manifest["bu_codes"] != filtered_nl_gdf['bu_code'].tolist():
+        preview_manifest = None  # The preview was made for another selection under the same name
+    if preview_manifest is not None:
+        matching_kaartbladindex_kaartbladNr_suffix = preview_manifest["kaartblad"]
+    else:
+        _, matching_kaartbladindex_kaartbladNr_suffix = find_matching_index(nl_boundary_gdf, kaartbladindex_gdf)
+    print('matching_kaartbladindex_kaartbladNr_suffix: ', matching_kaartbladindex_kaartbladNr_suffix)
+    try:
+        download_and_extract_building_boundaries(matching_kaartbladindex_kaartbladNr_suffix, neighborhood_name)
+
+        # Get the bounding box of neighborhood-level boundary dataset
+        xmin, ymin, xmax, ymax = nl_boundary_gdf.to_crs(epsg=28992).total_bounds
+        bbox = (float(xmin), float(ymin), float(xmax), float(ymax))
+
+        # Only download the raw DSM and DTM of the missing store tiles here; the gap filling
+        # and the CHM are CPU-bound and run in the compute stage (see compute_chm)
+        ensure_raw_tiles(tile_indices_for_bbox(bbox))
+    except BaseException:
+        # Without a manifest the neighborhood is never computed, so its kaartblad references would never be released
+        release_neighborhood_downloads(neighborhood_name)
+        raise
+
+    manifest = {
+        "name": neighborhood_name,
+        "municipality": sorted(filtered_nl_gdf['gm_naam'].unique().tolist()),
+        "bu_codes": filtered_nl_gdf['bu_code'].tolist(),
+        "bbox": bbox,
+        "kaartblad": matching_kaartbladindex_kaartbladNr_suffix
+    }
+    with open(f"{MANIFEST_DIR}/{neighborhood_name}.json", 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return neighborhood_name
+
+
+def compute_chm(neighborhood_name):
+    """
+    Builds the missing store tiles of a downloaded neighborhood (gap-filled DTM and CHM) and
+    cuts its DSM, DTM, gap-filled DTM and CHM windows from the tile store.
+    """
+    for directory in ['data/DSM', 'data/DTM', 'data/DTM_filtered', 'data/CHM_nl']:
+        os.makedirs(directory, exist_ok=True)
+
+    DSM_raster_path = f'data/DSM/{neighborhood_name}_dsm_05m.tif'  # DSM file path
+    DTM_raw_raster_path = f'data/DTM/{neighborhood_name}_dtm_05m.tif'  # DTM file path
+    DTM_raster_path = f'data/DTM_filtered/{neighborhood_name}_dtm_05m.tif'  # Output filtered raster file path
+    output_CHM_raster_path = f'data/CHM_nl/{neighborhood_name}.tif'   # Output CHM file path
+
+    manifest = read_manifest(neighborhood_name)
+    if manifest is None:
+        print(f"Missing manifest for {neighborhood_name}")
+        return None
+
+    # The gap-filled DTM and the CHM are computed once per tile in the tile store (from the
+    # raw tiles fetched by the download stage), so only the window of this neighborhood is cut here
+    bbox = tuple(manifest["bbox"])
+    read_store_window(bbox, DSM_raster_path, layer='DSM')
+    read_store_window(bbox, DTM_raw_raster_path, layer='DTM')
+    read_store_window(bbox, DTM_raster_path, layer='DTM_filtered')
+    read_store_window(bbox, output_CHM_raster_path, layer='CHM')
+    print(f"CHM created for {neighborhood_name}: {output_CHM_raster_path}")
+    return output_CHM_raster_path
+
+
+def clip_building_footprints(neighborhood_name):
+    """Clips the building boundaries of the kaartblad sheets to the neighborhood boundary."""
+    boundary_nl_path = f'data/boundary_nl/{neighborhood_name}.geojson'
+    output_building_vector_path = f'data/boundary_building/{neighborhood_name}_vector.shp'
+
+    if not os.path.exists(output_building_vector_path):
+        buildings_boundary_gpkg_files = glob.glob(os.path.join(f'data//boundary_building/{neighborhood_name}/', "*.gpkg"))
+        nl_gdf = gpd.read_file(boundary_nl_path)
+        buildings_boundary_gdf = gpd.read_file(buildings_boundary_gpkg_files[0])
+
+        if buildings_boundary_gdf.crs != nl_gdf.crs:
+            buildings_boundary_gdf = buildings_boundary_gdf.to_crs(nl_gdf.crs)
+
+        clipped_buildings = gpd.clip(buildings_boundary_gdf, nl_gdf)
+
+        clipped_buildings.to_file(output_building_vector_path, driver="ESRI Shapefile")
+        print(f"Clipped buildings dataset saved as '{output_building_vector_path}'.")
+    else:
+        print(f"File '{output_building_vector_path}' already exists. Skipping clipping operation.")
+
+    return output_building_vector_path
+
+
+def write_building_heights(nl_building_boundary_gdf, mean_values, output_json_file, extra_properties=None):
+    """
+    Saves building footprints with their estimated height as GeoJSON in EPSG:4326.
+
+    Parameters:
+    nl_building_boundary_gdf (GeoDataFrame): The building footprints.
+    mean_values (list): Estimated height per footprint (None where unknown).
+    output_json_file (str): Path of the GeoJSON file to write.
+    extra_properties (dict, optional): Additional per-footprint property lists, keyed by property name.
+    """
+    geometries = nl_building_boundary_gdf['geometry'].to_crs(epsg=4326)
+    extra_properties = extra_properties or {}
+
+    features = []
+    for i, (geometry, mean_value) in enumerate(zip(geometries, mean_values)):
+        properties = {"MeanValue": mean_value}
+        for key, values in extra_properties.items():
+            properties[key] = values[i]
+        features.append({
+            "type": "Feature",
+            "geometry": geometry.__geo_interface__,
+            "properties": properties
+        })
+
+    geojson_data = {
+        "type": "FeatureCollection",
+        "features": features
+    }
+
+    # Write aside and swap in, so readers such as the height service never see a half-written file
+    tmp_path = f"{output_json_file}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(geojson_data, f, indent=2)
+    os.replace(tmp_path, output_json_file)
+
+
+def estimate_building_heights(neighborhood_name, engine="labels", zonal_workers=None):
+    """
+    Computes the mean CHM value per building footprint, saves it as GeoJSON and appends it
+    to the partitioned building height dataset (partitioned by the municipality and the
+    kaartblad sheets in the neighborhood's manifest).
+
+    Parameters:
+    neighborhood_name (str): The neighborhood to process.
+    engine (str): 'labels' reuses cached building-ID rasters of the footprints (see label_cache),
+    'rasterstats' rasterises every footprint again with rasterstats.zonal_stats, 'parallel'
+    splits the footprints spatially over worker processes sharing one copy of the CHM (see parallel_zonal).
+    zonal_workers (int, optional): Number of worker processes of the 'parallel' engine (default: the number of CPUs).
+
+    Returns:
+    str: Path to the building height GeoJSON.
+    """
+    os.makedirs('output/estimated_building_height', exist_ok=True)
+
+    nl_CHM_raster_path = f'data/CHM_nl/{neighborhood_name}.tif'
+    output_building_vector_path = clip_building_footprints(neighborhood_name)
+
+    # read new shapefile clipped_buildings
+    nl_building_boundary_gdf = gpd.read_file(output_building_vector_path)
+
+    if engine == "labels":
+        mean_values = building_zonal_means(nl_building_boundary_gdf, nl_CHM_raster_path)
+    elif engine == "rasterstats":
+        stats = zonal_stats(nl_building_boundary_gdf, nl_CHM_raster_path, stats=["mean"])
+        mean_values = [stat['mean'] for stat in stats]
+    elif engine == "parallel":
+        mean_values = parallel_zonal_means(nl_building_boundary_gdf, nl_CHM_raster_path, zonal_workers)
+    else:
+        raise ValueError(f"Unknown zonal statistics engine: {engine}")
+
+    # save to json
+    output_json_file = f"output/estimated_building_height/{neighborhood_name}.json"
+    write_building_heights(nl_building_boundary_gdf, mean_values, output_json_file)
+    print(f"{neighborhood_name} nlbh_gdf dataset saved as '{output_json_file}' in GeoJSON format.")
+
+    manifest = read_manifest(neighborhood_name) or {}
+    municipality = "+".join(manifest.get("municipality", [])) or "unknown"
+    append_building_heights(nl_building_boundary_gdf, mean_values, neighborhood_name, municipality, manifest.get("kaartblad", []))
+    return output_json_file
+
+
+def compute_stage(neighborhood_name, engine="labels", zonal_workers=None):
+    """
+    Computes the CHM and the building heights of a downloaded neighborhood, then frees its
+    building boundary folder and its references in the kaartblad store.
+
+    Parameters:
+    neighborhood_name (str): The neighborhood to process.
+    engine (str): The zonal statistics engine (see estimate_building_heights).
+    zonal_workers (int, optional): Number of worker processes of the 'parallel' engine.
+
+    Returns:
+    str: Path to the building height GeoJSON.
+    """
+    compute_chm(neighborhood_name)
+    output_json_file = estimate_building_heights(neighborhood_name, engine, zonal_workers)
+    release_neighborhood_downloads(neighborhood_name)
+    return output_json_file
+
+
+def release_neighborhood_downloads(neighborhood_name):
+    """
+    Deletes the building boundary folder of a neighborhood and drops its references in the
+    kaartblad store. Called after the compute stage and when a job fails, so failed jobs do
+    not keep sheets from being evicted.
+    """
+    boundary_building_folder = f'data//boundary_building//{neighborhood_name}//'
+    if os.path.exists(boundary_building_folder):
+        shutil.rmtree(boundary_building_folder)
+        print(f"Folder '{boundary_building_folder}' and its contents have been deleted.")
+    else:
+        print(f"The folder '{boundary_building_folder}' does not exist.")
+
+    # The neighborhood no longer needs its kaartblad sheets in the shared store
+    release_kaartblad_archives(neighborhood_name)
+
+
+def run_pipeline(jobs, kaartbladindex_gdf, buurten_gdf=None, queue_size=2):
+    """
+    Runs the download and compute stages concurrently: a download thread fetches
+    neighborhood N+1 while neighborhood N is computed. At most `queue_size` downloaded
+    neighborhoods wait for the compute stage, which bounds disk and memory use.
+
+    Parameters:
+    jobs (list): (filtered_nl_gdf, neighborhood_name) tuples, e.g. from neighborhood_jobs().
+    kaartbladindex_gdf (GeoDataFrame): The kaartblad index.
+    buurten_gdf (GeoDataFrame, optional): All neighborhoods, used to prefetch boundaries.
+    queue_size (int): Maximum number of downloaded neighborhoods waiting to be computed.
+
+    Returns:
+    list: The neighborhoods that were processed successfully.
+    """
+    downloaded = queue.Queue(maxsize=queue_size)
+    finished = []
+
+    def producer():
+        for filtered_nl_gdf, neighborhood_name in jobs:
+            try:
+                download_stage(filtered_nl_gdf, neighborhood_name, kaartbladindex_gdf, buurten_gdf)
+            except Exception as e:
+                # e.g. find_matching_index() finds no kaartblad; that only skips this job
+                print(f"Download failed for {neighborhood_name}: {e}")
+                continue
+            # Blocks while the compute stage is `queue_size` neighborhoods behind
+            downloaded.put(neighborhood_name)
+        downloaded.put(None)
+
+    download_thread = threading.Thread(target=producer, daemon=True)
+    download_thread.start()
+
+    while True:
+        neighborhood_name = downloaded.get()
+        if neighborhood_name is None:
+            break
+        try:
+            compute_stage(neighborhood_name)
+        except Exception as e:
+            print(f"Computing failed for {neighborhood_name}: {e}")
+            release_neighborhood_downloads(neighborhood_name)
+            continue
+        record_neighborhood(neighborhood_name)
+        finished.append(neighborhood_name)
+
+    download_thread.join()
+
+    # Keep the kaartblad store within its disk-size cap
+    evict_kaartblad_archives()
+    return finished
@@ -0,0 +1,167 @@
+import os
+import json
+import shutil
+
+import numpy as np
+import geopandas as gpd
+import rasterio
+
+from .data_download import download_neighborhood_data, find_matching_index, download_and_extract_building_boundaries, ahn_05m_for_study_area
+from .CHM_caluate import fill_raster_gaps, subtract_rasters
+from .tile_store import tile_indices_for_bbox, tiles_complete, read_store_window, snap_bbox
+from .label_cache import label_raster
+from .archive_store import release_kaartblad_archives
+from .pipeline import clip_building_footprints, write_building_heights, PREVIEW_MANIFEST_DIR
+
+# Preview runs work on a much coarser grid than the 2.5 m of the full run: the rasters are
+# averaged down from the tile store where its tiles already exist, and requested decimated
+# from the WCS otherwise. Preview outputs are kept apart from the full-resolution ones.
+PREVIEW_RESOLUTION = 10.0
+PREVIEW_DATA_DIR = "data/preview"
+PREVIEW_OUTPUT_DIR = "output/preview"
+
+
+def zonal_moments_from_labels(data, labels, n_features, nodata=None):
+    """
+    Computes the pixel count, mean and standard deviation of the raster values per building from a
+    label raster or a stack of label rasters (see label_raster).
+
+    Returns:
+    tuple: (counts, means, stds) arrays of length n_features; means and stds are NaN where a footprint covers no valid pixel.
+    """
+    valid_data = ~np.isnan(data)
+    if nodata is not None:
+        valid_data &= data != nodata
+
+    counts = np.zeros(n_features + 1, dtype=np.int64)
+    sums = np.zeros(n_features + 1, dtype=np.float64)
+    squares = np.zeros(n_features + 1, dtype=np.float64)
+    for layer_labels in labels.reshape((-1,) + data.shape):
+        valid = (layer_labels > 0) & valid_data
+        valid_labels = layer_labels[valid]
+        values = data[valid].astype(np.float64)
+        counts += np.bincount(valid_labels, minlength=n_features + 1)
+        sums += np.bincount(valid_labels, weights=values, minlength=n_features + 1)
+        squares += np.bincount(valid_labels, weights=values * values, minlength=n_features + 1)
+    counts, sums, squares = counts[1:], sums[1:], squares[1:]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        stds = np.sqrt(np.maximum(squares / counts - means * means, 0))
+    return counts, means, stds
+
+
+def preview_error_bounds(footprints_gdf, counts, means, stds, resolution):
+    """
+    Estimates a per-building error bound of preview heights: a 95% sampling term
+    (1.96 * std / sqrt(n)) plus a mixed-pixel term. Pixels within half a pixel of the
+    footprint edge can mix roof and ground, so the mean can be off by up to the share of
+    such pixels (perimeter * resolution / 2 / area, at most 1) times the height itself.
+
+    Returns:
+    ndarray: The error bound in metres per footprint (NaN where the height is unknown).
+    """
+    areas = footprints_gdf.geometry.area.values
+    perimeters = footprints_gdf.geometry.length.values
+    with np.errstate(invalid='ignore', divide='ignore'):
+        edge_fraction = np.clip(perimeters * resolution / 2 / areas, 0, 1)
+        sampling = np.where(counts > 1, 1.96 * stds / np.sqrt(counts), 0)
+    edge_fraction = np.where(counts > 0, edge_fraction, 1)
+    return sampling + edge_fraction * np.abs(means)
+
+
+def _preview_rasters(bbox, neighborhood_name, resolution):
+    # Average the full-resolution store down if it already holds the area, request decimated rasters otherwise
+    chm_path = f"{PREVIEW_DATA_DIR}/{neighborhood_name}_chm.tif"
+    tiles = tile_indices_for_bbox(bbox)
+    if tiles_complete(tiles):
+        read_store_window(bbox, chm_path, layer='CHM', resolution=resolution)
+        return chm_path, "tile_store"
+
+    dsm_path = f"{PREVIEW_DATA_DIR}/{neighborhood_name}_dsm.tif"
+    dtm_path = f"{PREVIEW_DATA_DIR}/{neighborhood_name}_dtm.tif"
+    dtm_filled_path = f"{PREVIEW_DATA_DIR}/{neighborhood_name}_dtm_filled.tif"
+    extent = snap_bbox(bbox, resolution)
+    ahn_05m_for_study_area(extent, dsm_path, coverage_id='dsm_05m', resolution=resolution)
+    ahn_05m_for_study_area(extent, dtm_path, coverage_id='dtm_05m', resolution=resolution)
+    fill_raster_gaps(dtm_path, dtm_filled_path)
+    subtract_rasters(dsm_path, dtm_filled_path, chm_path)
+    return chm_path, "wcs"
+
+
+def preview_stage(filtered_nl_gdf, neighborhood_name, kaartbladindex_gdf, buurten_gdf=None, resolution=PREVIEW_RESOLUTION):
+    """
+    Computes approximate building heights of a neighborhood on a coarse grid, with an
+    estimated error bound per building. The footprints are clipped exactly like in the full
+    run, so they come from the full kaartblad sheets: the first preview of an area downloads
+    those sheets into the kaartblad store, which costs about as much as the full run's
+    download. Only the rasters are coarse. The sheets are recorded in a preview manifest, so a
+    later download_stage() of the same neighborhood reuses them and the clipped footprints.
+
+    Parameters:
+    filtered_nl_gdf (GeoDataFrame): The selected neighborhoods.
+    neighborhood_name (str): The name used for all files of this job.
+    kaartbladindex_gdf (GeoDataFrame): The kaartblad index.
+    buurten_gdf (GeoDataFrame, optional): All neighborhoods, used to prefetch boundaries of the municipality.
+    resolution (float): Pixel size of the preview in metres.
+
+    Returns:
+    str: Path to the preview building height GeoJSON (with 'MeanValue' and 'ErrorBound' properties).
+    """
+    for directory in ['data/boundary_nl', 'data/boundary_building', PREVIEW_DATA_DIR, PREVIEW_OUTPUT_DIR, PREVIEW_MANIFEST_DIR]:
+        os.makedirs(directory, exist_ok=True)
+
+    nl_boundary_gdf = download_neighborhood_data(filtered_nl_gdf, neighborhood_name, buurten_gdf)
+    if nl_boundary_gdf is None:
+        raise RuntimeError(f"No neighborhood boundary available for {neighborhood_name}")
+
+    _, matching_kaartbladindex_kaartbladNr_suffix = find_matching_index(nl_boundary_gdf, kaartbladindex_gdf)
+    download_and_extract_building_boundaries(matching_kaartbladindex_kaartbladNr_suffix, neighborhood_name)
+    footprints_path = clip_building_footprints(neighborhood_name)
+
+    # Only the clipped footprints are kept; the full run fetches the sheets again from the kaartblad store if needed
+    shutil.rmtree(f'data/boundary_building/{neighborhood_name}', ignore_errors=True)
+    release_kaartblad_archives(neighborhood_name)
+
+    xmin, ymin, xmax, ymax = nl_boundary_gdf.to_crs(epsg=28992).total_bounds
+    bbox = (float(xmin), float(ymin), float(xmax), float(ymax))
+    chm_path, source = _preview_rasters(bbox, neighborhood_name, resolution)
+
+    footprints_gdf = gpd.read_file(footprints_path)
+    with rasterio.open(chm_path) as raster:
+        if footprints_gdf.crs != raster.crs:
+            footprints_gdf = footprints_gdf.to_crs(raster.crs)
+        data = raster.read(1)
+        labels = label_raster(footprints_gdf, raster.transform, raster.shape, raster.crs)
+        counts, means, stds = zonal_moments_from_labels(data, labels, len(footprints_gdf), raster.nodata)
+
+        # Footprints smaller than a preview pixel contain no pixel centre; take the pixel below them instead
+        missing = np.flatnonzero(counts == 0)
+        if missing.size:
+            points = footprints_gdf.geometry.iloc[missing].representative_point()
+            for i, value in zip(missing, raster.sample([(p.x, p.y) for p in points], masked=True)):
+                if not np.ma.is_masked(value[0]) and value[0] > 0:
+                    means[i] = float(value[0])
+
+    error_bounds = preview_error_bounds(footprints_gdf, counts, means, stds, resolution)
+    mean_values = [None if np.isnan(v) else float(v) for v in means]
+    error_values = [None if np.isnan(v) else float(v) for v in error_bounds]
+
+    output_json_file = f"{PREVIEW_OUTPUT_DIR}/{neighborhood_name}.json"
+    write_building_heights(footprints_gdf, mean_values, output_json_file, {"ErrorBound": error_values})
+
+    manifest = {
+        "name": neighborhood_name,
+        "municipality": sorted(filtered_nl_gdf['gm_naam'].unique().tolist()),
+        "bu_codes": filtered_nl_gdf['bu_code'].tolist(),
+        "bbox": bbox,
+        "kaartblad": matching_kaartbladindex_kaartbladNr_suffix,
+        "footprints": footprints_path,
+        "resolution": resolution,
+        "source": source
+    }
+    with open(f"{PREVIEW_MANIFEST_DIR}/{neighborhood_name}.json", 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"{neighborhood_name} preview at {resolution} m saved as '{output_json_file}'")
+    return output_json_file
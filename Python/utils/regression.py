@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+
+import numpy as np
+import geopandas as gpd
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
+from rasterstats import zonal_stats
+from sklearn.metrics import root_mean_squared_error
+
+from . import label_cache
+from .CHM_caluate import save_raster, fill_save_raster, fill_raster_gaps, subtract_rasters
+from .pipeline import write_building_heights
+from .parallel_zonal import parallel_zonal_means
+
+# Golden fixtures shipped in assets/: the downtown Wageningen footprints with their
+# ground-truth heights, and the building heights the original pipeline estimated for them.
+REGRESSION_FOOTPRINTS = "assets/downtown_clipped_buildings_real.shp"
+REGRESSION_REFERENCE = "assets/downtown_wageningen_estimated.json"
+REGRESSION_REPORT = "output/regression/report.json"
+
+# Explicit tolerances an engine must meet to count as equivalent
+HEIGHT_TOLERANCE = 0.25  # metres, per building, against the reference heights
+MIN_MATCH_FRACTION = 0.99  # share of buildings that must be within HEIGHT_TOLERANCE
+RMSE_TOLERANCE = 0.05  # metres, change of the RMSE against the ground truth
+ENGINE_TOLERANCE = 1e-4  # metres, for every building, between an engine and the baseline engine
+
+
+def build_regression_fixture(work_dir, resolution=0.5):
+    """
+    Builds synthetic DSM and DTM rasters from the golden fixtures: a sloping terrain with
+    no-data gaps under the buildings (as in the AHN DTM), and a DSM in which every footprint
+    stands at its reference height above that terrain.
+
+    Parameters:
+    work_dir (str): Folder for the fixture rasters.
+    resolution (float): Pixel size in metres.
+
+    Returns:
+    dict: Paths of the fixture rasters and the footprints GeoDataFrame.
+    """
+    footprints_gdf = gpd.read_file(REGRESSION_FOOTPRINTS)
+    with open(REGRESSION_REFERENCE, 'r') as f:
+        reference_heights = [feature["properties"]["MeanValue"] for feature in json.load(f)["features"]]
+
+    xmin, ymin, xmax, ymax = footprints_gdf.total_bounds
+    xmin, ymin = np.floor(xmin) - 50, np.floor(ymin) - 50
+    xmax, ymax = np.ceil(xmax) + 50, np.ceil(ymax) + 50
+    cols = int(round((xmax - xmin) / resolution))
+    rows = int(round((ymax - ymin) / resolution))
+    transform = from_origin(xmin, ymax, resolution, resolution)
+
+    # Gently sloping terrain around 7 m NAP
+    x = xmin + (np.arange(cols) + 0.5) * resolution
+    y = ymax - (np.arange(rows) + 0.5) * resolution
+    terrain = (7 + 0.001 * (x[np.newaxis, :] - xmin) + 0.002 * (y[:, np.newaxis] - ymin)).astype(np.float32)
+
+    # Buildings at their reference height; the DTM has no data below them
+    shapes = [(geometry, height) for geometry, height in zip(footprints_gdf.geometry, reference_heights)
+              if geometry is not None and height is not None]
+    building_heights = rasterize(shapes, out_shape=(rows, cols), transform=transform, fill=0, dtype='float32')
+    building_mask = rasterize([(geometry, 1) for geometry, _ in shapes], out_shape=(rows, cols), transform=transform,
+                              fill=0, dtype='uint8').astype(bool)
+
+    dtm_data = terrain.copy()
+    dtm_data[building_mask] = np.nan
+
+    paths = {
+        "dsm": os.path.join(work_dir, "dsm.tif"),
+        "dtm": os.path.join(work_dir, "dtm.tif"),
+        "dtm_filled": os.path.join(work_dir, "dtm_filled.tif"),
+        "chm": os.path.join(work_dir, "chm.tif"),
+    }
+    save_raster(paths["dsm"], terrain + building_heights, transform.to_gdal(), footprints_gdf.crs.to_wkt())
+    fill_save_raster(paths["dtm"], dtm_data, transform.to_gdal(), None)
+
+    return {"paths": paths, "footprints": footprints_gdf, "reference": reference_heights}
+
+
+def _zonal_means(engine, footprints_gdf, chm_path):
+    if engine == "rasterstats":
+        return [stat['mean'] for stat in zonal_stats(footprints_gdf, chm_path, stats=["mean"])]
+    if engine == "labels":
+        return label_cache.building_zonal_means(footprints_gdf, chm_path)
+    if engine == "parallel":
+        return parallel_zonal_means(footprints_gdf, chm_path)
+    raise ValueError(f"Unknown zonal statistics engine: {engine}")
+
+
+def compare_heights(candidate, reference, tolerance):
+    """
+    Compares two lists of per-building heights (None = unknown).
+
+    Returns:
+    dict: Number of compared buildings, max/p99 absolute difference, share within `tolerance`
+    and the number of buildings that are unknown in only one of the two.
+    """
+    candidate = np.array([np.nan if v is None else v for v in candidate], dtype=np.float64)
+    reference = np.array([np.nan if v is None else v for v in reference], dtype=np.float64)
+    both = ~np.isnan(candidate) & ~np.isnan(reference)
+    differences = np.abs(candidate[both] - reference[both])
+
+    return {
+        "compared": int(both.sum()),
+        "unknown_mismatch": int((np.isnan(candidate) != np.isnan(reference)).sum()),
+        "max_abs_diff": float(differences.max()) if differences.size else 0.0,
+        "p99_abs_diff": float(np.percentile(differences, 99)) if differences.size else 0.0,
+        "within_tolerance": float((differences <= tolerance).mean()) if differences.size else 1.0
+    }
+
+
+def rmse_against_ground_truth(footprints_gdf, heights):
+    """RMSE of per-building heights against the ground truth, with the same filtering as evaluate.py."""
+    ground_truth = footprints_gdf["dd_h_dak_m"] - footprints_gdf["h_maaiveld"]
+    estimated = np.array([np.nan if v is None else v for v in heights], dtype=np.float64)
+    valid = ground_truth.notna().values & ~np.isnan(estimated)
+    return float(root_mean_squared_error(ground_truth.values[valid], estimated[valid]))
+
+
+def run_regression(engines=("rasterstats", "labels", "parallel"), baseline="rasterstats", resolution=0.5, work_dir=None):
+    """
+    Runs gap filling, subtraction, zonal statistics and export on the golden fixtures and
+    checks every zonal statistics engine for speed and numeric drift.
+
+    An engine passes when its heights stay within HEIGHT_TOLERANCE of the reference for at
+    least MIN_MATCH_FRACTION of the buildings, it knows a height for exactly the buildings the
+    reference knows, its RMSE against the ground truth is within RMSE_TOLERANCE of the
+    reference RMSE, and it matches the baseline engine within ENGINE_TOLERANCE for every
+    building, with the same unknown heights.
+
+    Parameters:
+    engines (tuple): The zonal statistics engines to run.
+    baseline (str): The engine the speed-up and engine drift are measured against.
+    resolution (float): Pixel size of the fixture rasters in metres.
+    work_dir (str, optional): Folder for intermediate files; a temporary folder is used and removed if omitted.
+
+    Returns:
+    dict: The report, with 'passed' set to True if every engine passed.
+    """
+    cleanup = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="regression_")
+    os.makedirs(work_dir, exist_ok=True)
+    original_label_cache_dir = label_cache.LABEL_CACHE_DIR
+    label_cache.LABEL_CACHE_DIR = os.path.join(work_dir, "label_cache")
+
+    try:
+        fixture = build_regression_fixture(work_dir, resolution)
+        paths = fixture["paths"]
+        footprints_gdf = fixture["footprints"]
+        reference = fixture["reference"]
+        reference_rmse = rmse_against_ground_truth(footprints_gdf, reference)
+
+        # Shared raster stages
+        timings = {}
+        start = time.perf_counter()
+        fill_raster_gaps(paths["dtm"], paths["dtm_filled"])
+        timings["fill_raster_gaps"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        subtract_rasters(paths["dsm"], paths["dtm_filled"], paths["chm"])
+        timings["subtract_rasters"] = time.perf_counter() - start
+
+        # Zonal statistics and export per engine; the second run of an engine shows its warm-cache time
+        results = {}
+        for engine in engines:
+            start = time.perf_counter()
+            heights = _zonal_means(engine, footprints_gdf, paths["chm"])
+            cold_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            _zonal_means(engine, footprints_gdf, paths["chm"])
+            warm_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            write_building_heights(footprints_gdf, heights, os.path.join(work_dir, f"{engine}.json"))
+            export_seconds = time.perf_counter() - start
+
+            rmse = rmse_against_ground_truth(footprints_gdf, heights)
+            results[engine] = {
+                "heights": heights,
+                "zonal_seconds": cold_seconds,
+                "zonal_warm_seconds": warm_seconds,
+                "export_seconds": export_seconds,
+                "rmse": rmse,
+                "rmse_drift": abs(rmse - reference_rmse),
+                "vs_reference": compare_heights(heights, reference, HEIGHT_TOLERANCE)
+            }
+
+        report = {
+            "resolution": resolution,
+            "buildings": len(footprints_gdf),
+            "reference_rmse": reference_rmse,
+            "stage_seconds": timings,
+            "tolerances": {
+                "height": HEIGHT_TOLERANCE,
+                "min_match_fraction": MIN_MATCH_FRACTION,
+                "rmse": RMSE_TOLERANCE,
+                "engine": ENGINE_TOLERANCE
+            },
+            "engines": {},
+            "passed": True
+        }
+
+        for engine, result in results.items():
+            vs_baseline = compare_heights(result["heights"], results[baseline]["heights"], ENGINE_TOLERANCE)
+            # Against the baseline an engine must be equivalent for every building, unknown heights included
+            passed = (result["vs_reference"]["within_tolerance"] >= MIN_MATCH_FRACTION
+                      and result["vs_reference"]["unknown_mismatch"] == 0
+                      and result["rmse_drift"] <= RMSE_TOLERANCE
+                      and vs_baseline["unknown_mismatch"] == 0
+                      and vs_baseline["max_abs_diff"] <= ENGINE_TOLERANCE)
+            report["engines"][engine] = {
+                "zonal_seconds": result["zonal_seconds"],
+                "zonal_warm_seconds": result["zonal_warm_seconds"],
+                "export_seconds": result["export_seconds"],
+                "speedup_vs_baseline": results[baseline]["zonal_seconds"] / result["zonal_seconds"],
+                "warm_speedup_vs_baseline": results[baseline]["zonal_seconds"] / result["zonal_warm_seconds"],
+                "rmse": result["rmse"],
+                "rmse_drift": result["rmse_drift"],
+                "vs_reference": result["vs_reference"],
+                "vs_baseline": vs_baseline,
+                "passed": passed
+            }
+            report["passed"] = report["passed"] and passed
+
+        os.makedirs(os.path.dirname(REGRESSION_REPORT), exist_ok=True)
+        with open(REGRESSION_REPORT, 'w') as f:
+            json.dump(report, f, indent=2)
+        return report
+
+    finally:
+        label_cache.LABEL_CACHE_DIR = original_label_cache_dir
+        if cleanup:
+            shutil.rmtree(work_dir, ignore_errors=True)
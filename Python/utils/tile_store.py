@@ -0,0 +1,246 @@
+import os
+import math
+import threading
+
+import numpy as np
+from osgeo import gdal
+gdal.UseExceptions()
+
+from .file_lock import file_lock
+from .data_download import ahn_05m_for_study_area
+from .CHM_caluate import read_raster, fill_read_raster, save_raster, fill_interpolate_raster_only_missing, chm_from_arrays, aligned_virtual_raster
+
+# National tile grid in EPSG:28992 (metres). Tiles are aligned to multiples of TILE_SIZE,
+# so every neighborhood that touches a tile reuses the same download, gap-fill and CHM.
+TILE_STORE_DIR = "data/tile_store"
+TILE_SIZE = 1000
+TILE_HALO = 100
+TILE_RESOLUTION = 2.5
+TILE_LAYERS = ["DSM", "DTM", "DTM_filtered", "CHM"]
+# Haloed DSM/DTM as downloaded, kept until the tile is built from them
+TILE_RAW_LAYERS = ["DSM", "DTM"]
+
+
+def tile_indices_for_bbox(bbox, tile_size=TILE_SIZE):
+    """
+    Lists the national grid tiles that intersect a bounding box.
+
+    Parameters:
+    bbox (tuple): (xmin, ymin, xmax, ymax) in EPSG:28992.
+    tile_size (int): Tile edge length in metres.
+
+    Returns:
+    list: (col, row) tile indices covering the bounding box.
+    """
+    xmin, ymin, xmax, ymax = bbox
+    cols = range(math.floor(xmin / tile_size), max(math.ceil(xmax / tile_size), math.floor(xmin / tile_size) + 1))
+    rows = range(math.floor(ymin / tile_size), max(math.ceil(ymax / tile_size), math.floor(ymin / tile_size) + 1))
+    return [(col, row) for row in rows for col in cols]
+
+
+def tile_path(layer, col, row):
+    """Returns the path of a layer ('DSM', 'DTM', 'DTM_filtered' or 'CHM') of a tile in the store."""
+    return f"{TILE_STORE_DIR}/{layer}/{col}_{row}.tif"
+
+
+def raw_tile_path(layer, col, row):
+    """Returns the path of the downloaded, haloed 'DSM' or 'DTM' of a tile that is not built yet."""
+    return f"{TILE_STORE_DIR}/raw/{layer}/{col}_{row}.tif"
+
+
+def snap_bbox(bbox, resolution=TILE_RESOLUTION):
+    """Expands a bounding box outwards so its edges fall on the store's pixel grid."""
+    xmin, ymin, xmax, ymax = bbox
+    return (math.floor(xmin / resolution) * resolution, math.floor(ymin / resolution) * resolution,
+            math.ceil(xmax / resolution) * resolution, math.ceil(ymax / resolution) * resolution)
+
+
+def raster_bbox(raster_path):
+    """Returns the (xmin, ymin, xmax, ymax) extent of a north-up raster file."""
+    ds = gdal.Open(raster_path)
+    transform = ds.GetGeoTransform()
+    xmin = transform[0]
+    ymax = transform[3]
+    xmax = xmin + transform[1] * ds.RasterXSize
+    ymin = ymax + transform[5] * ds.RasterYSize
+    return (xmin, ymin, xmax, ymax)
+
+
+def _crop_core(data, transform, core_bounds):
+    # Locate the core (halo-free) part of the tile on the haloed grid
+    xmin, ymin, xmax, ymax = core_bounds
+    col_off = int(round((xmin - transform[0]) / transform[1]))
+    row_off = int(round((transform[3] - ymax) / -transform[5]))
+    n_cols = int(round((xmax - xmin) / transform[1]))
+    n_rows = int(round((ymax - ymin) / -transform[5]))
+    core = data[row_off:row_off + n_rows, col_off:col_off + n_cols]
+    core_transform = (xmin, transform[1], 0, ymax, 0, transform[5])
+    return core, core_transform
+
+
+def _save_tile(layer, col, row, data, transform, projection):
+    # Write to a temporary name first so a concurrent reader never sees a half-written tile
+    output_path = tile_path(layer, col, row)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp.tif"
+    save_raster(tmp_path, data, transform, projection)
+    os.replace(tmp_path, output_path)
+
+
+def _haloed_bounds(col, row, tile_size, halo):
+    core_bounds = (col * tile_size, row * tile_size, (col + 1) * tile_size, (row + 1) * tile_size)
+    haloed_bounds = (core_bounds[0] - halo, core_bounds[1] - halo, core_bounds[2] + halo, core_bounds[3] + halo)
+    return core_bounds, haloed_bounds
+
+
+def download_raw_tile(col, row, tile_size=TILE_SIZE, halo=TILE_HALO, resolution=TILE_RESOLUTION):
+    """
+    Downloads the DSM and DTM of one tile including a halo into the raw part of the store.
+    Only network I/O: gap filling and the CHM are left to build_tile().
+
+    Parameters:
+    col (int), row (int): Tile indices on the national grid.
+    tile_size (int): Tile edge length in metres.
+    halo (int): Extra margin in metres downloaded around the tile for gap filling.
+    resolution (float): Pixel size in metres.
+
+    Returns:
+    list: Paths to the raw DSM and DTM of the tile.
+    """
+    _, haloed_bounds = _haloed_bounds(col, row, tile_size, halo)
+    coverage_ids = {"DSM": 'dsm_05m', "DTM": 'dtm_05m'}
+
+    raw_paths = []
+    for layer in TILE_RAW_LAYERS:
+        os.makedirs(f"{TILE_STORE_DIR}/raw/{layer}", exist_ok=True)
+        raw_path = raw_tile_path(layer, col, row)
+        if not os.path.exists(raw_path):
+            # Download under a temporary name so a half-downloaded tile is never built
+            tmp_path = f"{raw_path}.{os.getpid()}.tmp.tif"
+            ahn_05m_for_study_area(haloed_bounds, tmp_path, coverage_id=coverage_ids[layer], resolution=resolution)
+            os.replace(tmp_path, raw_path)
+        raw_paths.append(raw_path)
+    return raw_paths
+
+
+def build_tile(col, row, tile_size=TILE_SIZE, halo=TILE_HALO, resolution=TILE_RESOLUTION):
+    """
+    Fills the DTM gaps of one tile on its haloed grid and stores the DSM, DTM, filled DTM
+    and CHM of the tile core. The raw haloed DSM and DTM are downloaded first if
+    download_raw_tile() has not fetched them yet, and removed once the tile is complete.
+
+    The halo makes the nearest-neighbour gap filling identical on both sides of a tile
+    edge as long as the nearest known DTM pixel lies within `halo` metres.
+
+    Parameters:
+    col (int), row (int): Tile indices on the national grid.
+    tile_size (int): Tile edge length in metres.
+    halo (int): Extra margin in metres downloaded around the tile for gap filling.
+    resolution (float): Pixel size in metres.
+
+    Returns:
+    str: Path to the CHM tile.
+    """
+    for layer in TILE_LAYERS:
+        os.makedirs(f"{TILE_STORE_DIR}/{layer}", exist_ok=True)
+
+    core_bounds, haloed_bounds = _haloed_bounds(col, row, tile_size, halo)
+    dsm_raw_path, dtm_raw_path = download_raw_tile(col, row, tile_size, halo, resolution)
+
+    # Read both through virtual rasters on the exact haloed grid, so a response that the
+    # WCS rounded to a slightly different extent still lines up pixel for pixel
+    dsm_vrt_path = f"/vsimem/{col}_{row}_{os.getpid()}_{threading.get_ident()}_dsm.vrt"
+    dtm_vrt_path = f"/vsimem/{col}_{row}_{os.getpid()}_{threading.get_ident()}_dtm.vrt"
+    aligned_virtual_raster(dsm_raw_path, haloed_bounds, resolution, resolution, dsm_vrt_path)
+    aligned_virtual_raster(dtm_raw_path, haloed_bounds, resolution, resolution, dtm_vrt_path)
+    dsm_data, transform, projection = read_raster(dsm_vrt_path)
+    dtm_data, _ = fill_read_raster(dtm_vrt_path)
+    gdal.Unlink(dsm_vrt_path)
+    gdal.Unlink(dtm_vrt_path)
+
+    # Fill the DTM gaps on the haloed grid (tiles without any ground pixel stay empty)
+    if np.isnan(dtm_data).all():
+        filled_dtm_data = dtm_data
+    else:
+        filled_dtm_data = fill_interpolate_raster_only_missing(dtm_data)
+
+    dsm_core, core_transform = _crop_core(dsm_data, transform, core_bounds)
+    dtm_core, _ = _crop_core(dtm_data, transform, core_bounds)
+    filled_dtm_core, _ = _crop_core(filled_dtm_data, transform, core_bounds)
+
+    # Same conventions as the per-neighborhood files: no-data is stored as 0
+    dtm_core = np.nan_to_num(dtm_core, nan=0)
+    filled_dtm_core = np.nan_to_num(filled_dtm_core, nan=0)
+    chm_core = chm_from_arrays(dsm_core.astype(np.float32), filled_dtm_core)
+
+    # The CHM is written last, so its presence marks a complete tile
+    _save_tile("DSM", col, row, dsm_core, core_transform, projection)
+    _save_tile("DTM", col, row, dtm_core, core_transform, projection)
+    _save_tile("DTM_filtered", col, row, filled_dtm_core, core_transform, projection)
+    _save_tile("CHM", col, row, chm_core, core_transform, projection)
+
+    os.remove(dsm_raw_path)
+    os.remove(dtm_raw_path)
+    print(f"Tile {col}_{row} added to the tile store")
+    return tile_path("CHM", col, row)
+
+
+def tiles_complete(tiles):
+    """Returns True if every layer of every tile in `tiles` is in the store."""
+    return all(os.path.exists(tile_path(layer, col, row)) for col, row in tiles for layer in TILE_LAYERS)
+
+
+def ensure_tiles(tiles):
+    """Builds every tile in `tiles` that is not yet complete in the store."""
+    for col, row in tiles:
+        if all(os.path.exists(tile_path(layer, col, row)) for layer in TILE_LAYERS):
+            continue
+        # Another worker may be building the same tile; wait for it and check again
+        with file_lock(f"{TILE_STORE_DIR}/locks/{col}_{row}.lock"):
+            if not all(os.path.exists(tile_path(layer, col, row)) for layer in TILE_LAYERS):
+                build_tile(col, row)
+
+
+def ensure_raw_tiles(tiles):
+    """
+    Downloads the raw DSM and DTM of every tile in `tiles` that is neither complete in the
+    store nor downloaded yet, without building it. Used by the download stage, so the
+    CPU-bound gap filling runs in the compute stage.
+    """
+    for col, row in tiles:
+        if tiles_complete([(col, row)]) or all(os.path.exists(raw_tile_path(layer, col, row)) for layer in TILE_RAW_LAYERS):
+            continue
+        with file_lock(f"{TILE_STORE_DIR}/locks/{col}_{row}.lock"):
+            if not tiles_complete([(col, row)]):
+                download_raw_tile(col, row)
+
+
+def read_store_window(bbox, output_path, layer, resolution=None):
+    """
+    Cuts the window of a bounding box from a layer of the tile store and saves it as a GeoTIFF.
+    Missing tiles are computed first.
+
+    Parameters:
+    bbox (tuple): (xmin, ymin, xmax, ymax) in EPSG:28992.
+    output_path (str): Path of the GeoTIFF to write.
+    layer (str): One of 'DSM', 'DTM', 'DTM_filtered' or 'CHM'.
+    resolution (float, optional): Coarser pixel size in metres; the window is then averaged down to it.
+
+    Returns:
+    str: The output path.
+    """
+    tiles = tile_indices_for_bbox(bbox)
+    ensure_tiles(tiles)
+
+    # Mosaic the tiles virtually and cut the pixel-aligned window
+    tile_paths = [tile_path(layer, col, row) for col, row in tiles]
+    vrt = gdal.BuildVRT('', tile_paths)
+    if resolution is None:
+        xmin, ymin, xmax, ymax = snap_bbox(bbox)
+        gdal.Translate(output_path, vrt, projWin=[xmin, ymax, xmax, ymin])
+    else:
+        xmin, ymin, xmax, ymax = snap_bbox(bbox, resolution)
+        gdal.Translate(output_path, vrt, projWin=[xmin, ymax, xmax, ymin], xRes=resolution, yRes=resolution,
+                       resampleAlg='average')
+    vrt = None
+    print(f"{layer} window cut from the tile store and saved as {output_path}")
+    return output_path
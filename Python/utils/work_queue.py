@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import socket
+import threading
+
+from .pipeline import download_stage, compute_stage, record_neighborhood, release_neighborhood_downloads
+from .archive_store import evict_kaartblad_archives
+
+# Work queue on shared storage. A job is one JSON file that moves between the state
+# folders with os.rename, which is atomic, so exactly one worker can claim it.
+QUEUE_DIR = "data/queue"
+QUEUE_STATES = ["pending", "claimed", "done", "failed"]
+LEASE_SECONDS = 900
+HEARTBEAT_SECONDS = 30
+MAX_ATTEMPTS = 3
+
+
+def _job_path(state, job_id):
+    return f"{QUEUE_DIR}/{state}/{job_id}.json"
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def job_id_for(municipality, neighborhood):
+    """Builds a queue-wide unique job id (and output name) for a neighborhood of a municipality."""
+    return f"{municipality}_{neighborhood}".replace(" ", "_").replace("/", "-")
+
+
+def enqueue_jobs(buurten_gdf, municipalities=None):
+    """
+    Adds one job per neighborhood to the queue. Jobs already in any state are skipped,
+    so enqueueing the same selection twice is harmless.
+
+    Parameters:
+    buurten_gdf (GeoDataFrame): GeoDataFrame containing municipality and neighborhood data.
+    municipalities (list, optional): Only enqueue these municipalities; all of Buurten.csv if omitted.
+
+    Returns:
+    int: The number of jobs added.
+    """
+    for state in QUEUE_STATES:
+        os.makedirs(f"{QUEUE_DIR}/{state}", exist_ok=True)
+
+    if municipalities is not None:
+        buurten_gdf = buurten_gdf[buurten_gdf["gm_naam"].isin(municipalities)]
+
+    added = 0
+    for (municipality, neighborhood), group in buurten_gdf.groupby(["gm_naam", "bu_naam"]):
+        job_id = job_id_for(municipality, neighborhood)
+        if any(os.path.exists(_job_path(state, job_id)) for state in QUEUE_STATES):
+            continue
+        _write_json(_job_path("pending", job_id), {
+            "job_id": job_id,
+            "municipality": municipality,
+            "neighborhood": neighborhood,
+            "bu_codes": group["bu_code"].tolist(),
+            "attempts": 0
+        })
+        added += 1
+
+    print(f"{added} jobs added to the queue")
+    return added
+
+
+def claim_job(worker_id):
+    """
+    Claims the next pending job for a worker.
+
+    Parameters:
+    worker_id (str): Unique name of the worker, e.g. 'host-3'.
+
+    Returns:
+    dict or None: The claimed job, or None if no job is pending.
+    """
+    pending_dir = f"{QUEUE_DIR}/pending"
+    for file_name in sorted(os.listdir(pending_dir)):
+        if not file_name.endswith(".json"):
+            continue
+        job_id = file_name[:-len(".json")]
+        try:
+            # rename keeps the mtime, which is the lease clock in claimed/; start it now, so the
+            # job does not look stalled to requeue_stalled_jobs() before it is rewritten below
+            os.utime(_job_path("pending", job_id))
+            os.rename(_job_path("pending", job_id), _job_path("claimed", job_id))
+        except FileNotFoundError:
+            continue  # Another worker was faster
+
+        job = _read_json(_job_path("claimed", job_id))
+        job["worker"] = worker_id
+        job["attempts"] = job.get("attempts", 0) + 1
+        job["claimed_at"] = time.time()
+        _write_json(_job_path("claimed", job_id), job)
+        return job
+    return None
+
+
+def heartbeat(job):
+    """Renews the lease of a claimed job. Raises FileNotFoundError if the lease was lost."""
+    os.utime(_job_path("claimed", job["job_id"]))
+
+
+def requeue_stalled_jobs(lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    """
+    Moves claimed jobs whose heartbeat is older than `lease_seconds` back to pending,
+    or to failed once they used up `max_attempts`.
+
+    Returns:
+    list: The ids of the recovered jobs.
+    """
+    recovered = []
+    now = time.time()
+    for file_name in os.listdir(f"{QUEUE_DIR}/claimed"):
+        if not file_name.endswith(".json"):
+            continue
+        job_id = file_name[:-len(".json")]
+        try:
+            if now - os.path.getmtime(_job_path("claimed", job_id)) < lease_seconds:
+                continue
+            job = _read_json(_job_path("claimed", job_id))
+            target_state = "failed" if job.get("attempts", 0) >= max_attempts else "pending"
+            os.rename(_job_path("claimed", job_id), _job_path(target_state, job_id))
+        except FileNotFoundError:
+            continue  # Finished or recovered by someone else meanwhile
+        print(f"Recovered stalled job {job_id} from worker {job.get('worker')} to {target_state}")
+        recovered.append(job_id)
+    return recovered
+
+
+def finish_job(job, status, error=None):
+    """
+    Records the outcome of a claimed job. Failed jobs go back to pending until they used
+    up MAX_ATTEMPTS.
+
+    Parameters:
+    job (dict): The claimed job.
+    status (str): 'done' or 'failed'.
+    error (str, optional): Error message of a failed job.
+    """
+    job["finished_at"] = time.time()
+    job["status"] = status
+    if error is not None:
+        job["error"] = error
+
+    if status == "failed" and job["attempts"] < MAX_ATTEMPTS:
+        target_state = "pending"
+    else:
+        target_state = status
+
+    # After a lost lease the claimed file may belong to the worker that claimed the job again
+    try:
+        claimed_job = _read_json(_job_path("claimed", job["job_id"]))
+    except FileNotFoundError:
+        claimed_job = None  # The lease was lost and the job recovered meanwhile
+    owns_claim = (claimed_job is not None and claimed_job.get("worker") == job["worker"]
+                  and claimed_job.get("claimed_at") == job["claimed_at"])
+    if claimed_job is not None and not owns_claim and target_state != "done":
+        print(f"Job {job['job_id']} was claimed again by worker {claimed_job.get('worker')}; leaving it to that worker")
+        return
+
+    _write_json(_job_path(target_state, job["job_id"]), job)
+    if owns_claim:
+        os.remove(_job_path("claimed", job["job_id"]))
+    if target_state == "done":
+        # A copy that was recovered to pending after a lost lease is not needed anymore
+        try:
+            os.remove(_job_path("pending", job["job_id"]))
+        except FileNotFoundError:
+            pass
+
+
+def _heartbeat_loop(job, stop_event):
+    while not stop_event.wait(HEARTBEAT_SECONDS):
+        try:
+            heartbeat(job)
+        except FileNotFoundError:
+            print(f"Lease on job {job['job_id']} was lost")
+            return
+
+
+def run_worker(worker_id, kaartbladindex_gdf, buurten_gdf, lease_seconds=LEASE_SECONDS, poll_seconds=10):
+    """
+    Claims and processes jobs until the queue is empty. Any number of workers on any number
+    of hosts can run this against the same data folder.
+
+    Parameters:
+    worker_id (str): Unique name of the worker.
+    kaartbladindex_gdf (GeoDataFrame): The kaartblad index.
+    buurten_gdf (GeoDataFrame): All neighborhoods.
+    lease_seconds (int): Age of the last heartbeat after which a job counts as stalled.
+    poll_seconds (int): Wait between polls while other workers still hold jobs.
+
+    Returns:
+    int: The number of jobs this worker finished.
+    """
+    finished = 0
+    while True:
+        requeue_stalled_jobs(lease_seconds)
+        job = claim_job(worker_id)
+
+        if job is None:
+            # Stop once nothing is pending and nothing can come back from a stalled worker
+            if not os.listdir(f"{QUEUE_DIR}/claimed") and not os.listdir(f"{QUEUE_DIR}/pending"):
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        print(f"Worker {worker_id} claimed job {job['job_id']} (attempt {job['attempts']})")
+        stop_event = threading.Event()
+        heartbeat_thread = threading.Thread(target=_heartbeat_loop, args=(job, stop_event), daemon=True)
+        heartbeat_thread.start()
+
+        try:
+            filtered_nl_gdf = buurten_gdf[buurten_gdf["bu_code"].isin(job["bu_codes"])]
+            download_stage(filtered_nl_gdf, job["job_id"], kaartbladindex_gdf, buurten_gdf)
+            compute_stage(job["job_id"])
+            record_neighborhood(job["job_id"])
+        except Exception as e:
+            # e.g. find_matching_index() finds no kaartblad; that only fails this job
+            stop_event.set()
+            heartbeat_thread.join()
+            print(f"Worker {worker_id} failed job {job['job_id']}: {e}")
+            release_neighborhood_downloads(job["job_id"])
+            finish_job(job, "failed", error=f"{type(e).__name__}: {e}")
+            continue
+
+        stop_event.set()
+        heartbeat_thread.join()
+        finish_job(job, "done")
+        finished += 1
+
+    # Keep the kaartblad store within its disk-size cap
+    evict_kaartblad_archives()
+    return finished
+
+
+def merge_completion_report(report_path=f"{QUEUE_DIR}/report.json"):
+    """
+    Merges the finished and failed jobs of all workers into one report.
+
+    Parameters:
+    report_path (str): Path of the JSON report to write.
+
+    Returns:
+    dict: The report.
+    """
+    jobs = {state: [] for state in QUEUE_STATES}
+    for state in QUEUE_STATES:
+        state_dir = f"{QUEUE_DIR}/{state}"
+        if not os.path.exists(state_dir):
+            continue
+        for file_name in sorted(os.listdir(state_dir)):
+            if file_name.endswith(".json"):
+                jobs[state].append(_read_json(f"{state_dir}/{file_name}"))
+
+    per_worker = {}
+    for job in jobs["done"]:
+        worker = per_worker.setdefault(job["worker"], {"done": 0, "seconds": 0.0})
+        worker["done"] += 1
+        worker["seconds"] += job["finished_at"] - job["claimed_at"]
+
+    report = {
+        "summary": {state: len(jobs[state]) for state in QUEUE_STATES},
+        "workers": per_worker,
+        "done": [{"job_id": job["job_id"], "worker": job["worker"], "attempts": job["attempts"],
+                  "seconds": round(job["finished_at"] - job["claimed_at"], 1)} for job in jobs["done"]],
+        "failed": [{"job_id": job["job_id"], "worker": job.get("worker"), "attempts": job.get("attempts"),
+                    "error": job.get("error")} for job in jobs["failed"]]
+    }
+
+    _write_json(report_path, report)
+    print(f"Completion report saved as {report_path}: {report['summary']}")
+    return report
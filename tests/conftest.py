@@ -0,0 +1,60 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import geopandas as gpd
+import rasterio
+from rasterio.transform import from_origin
+from shapely import affinity
+from shapely.geometry import box
+
+# The scripts run with Python/ as the import root (`from utils import *`)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Python"))
+
+CHM_NODATA = -9999.0
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Runs a test in an empty folder, since utils keeps its stores under relative data/ and output/ paths."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def overlapping_chm(workdir):
+    """
+    A CHM with no-data patches and footprints that overlap each other: a chain of
+    overlapping boxes, a box inside another, a rotated footprint crossing both, a footprint
+    smaller than a pixel and one that only covers no-data.
+
+    Returns:
+    tuple: (footprints GeoDataFrame, path to the CHM GeoTIFF).
+    """
+    rng = np.random.default_rng(7)
+    data = rng.uniform(0, 30, size=(80, 100)).astype(np.float32)
+    data[10:20, 60:75] = CHM_NODATA
+    data[50:54, 5:9] = np.nan
+
+    transform = from_origin(170000, 440200, 2.5, 2.5)
+    chm_path = str(workdir / "chm.tif")
+    with rasterio.open(chm_path, 'w', driver='GTiff', width=100, height=80, count=1, dtype='float32',
+                       crs='EPSG:28992', transform=transform, nodata=CHM_NODATA) as raster:
+        raster.write(data, 1)
+
+    x0, y0 = 170000, 440000
+    geometries = [
+        box(x0 + 10, y0 + 10, x0 + 40, y0 + 40),
+        box(x0 + 30, y0 + 20, x0 + 60, y0 + 50),
+        box(x0 + 50, y0 + 30, x0 + 80, y0 + 60),
+        box(x0 + 15, y0 + 15, x0 + 25, y0 + 25),
+        affinity.rotate(box(x0 + 20, y0 + 25, x0 + 70, y0 + 35), 30),
+        box(x0 + 100.2, y0 + 100.2, x0 + 100.8, y0 + 100.8),
+        box(x0 + 152, y0 + 152, x0 + 185, y0 + 172),
+        box(x0 + 8, y0 + 60, x0 + 20, y0 + 70),
+        box(x0 + 200, y0 + 20, x0 + 245, y0 + 180),
+    ]
+    footprints_gdf = gpd.GeoDataFrame(geometry=geometries, crs="EPSG:28992")
+    return footprints_gdf, chm_path
+
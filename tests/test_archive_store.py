@@ -0,0 +1,99 @@
+import os
+import time
+
+import pytest
+
+import utils.archive_store as archive_store
+from utils.archive_store import (acquire_kaartblad_archive, release_kaartblad_archives, evict_kaartblad_archives,
+                                 KAARTBLAD_STORE_DIR)
+from utils.file_lock import file_lock
+
+SHEET_BYTES = 100
+
+
+@pytest.fixture
+def downloads(workdir, monkeypatch):
+    """Replaces the PDOK download by a local file of SHEET_BYTES bytes and records the downloaded sheets."""
+    downloaded = []
+
+    def fake_download(suffix):
+        gpkg_path = f"{KAARTBLAD_STORE_DIR}/{suffix}_2020_hoogtestatistieken_gebouwen.gpkg"
+        with open(gpkg_path, 'wb') as f:
+            f.write(suffix.encode().ljust(SHEET_BYTES, b"\0"))
+        downloaded.append(suffix)
+        return {"gpkg": gpkg_path, "size": SHEET_BYTES, "sha256": archive_store._sha256(gpkg_path),
+                "last_access": time.time(), "refs": []}
+
+    monkeypatch.setattr(archive_store, "_download_kaartblad", fake_download)
+    return downloaded
+
+
+def test_sheet_is_downloaded_once_and_referenced(downloads):
+    path = acquire_kaartblad_archive("39fn2", "Binnenstad")
+    assert acquire_kaartblad_archive("39fn2", "Tarthorst") == path
+    assert downloads == ["39fn2"]
+    assert archive_store._load_index()["39fn2"]["refs"] == ["Binnenstad", "Tarthorst"]
+
+    release_kaartblad_archives("Binnenstad")
+    assert archive_store._load_index()["39fn2"]["refs"] == ["Tarthorst"]
+
+
+def test_damaged_sheet_is_downloaded_again(downloads):
+    path = acquire_kaartblad_archive("39fn2", "Binnenstad")
+    with open(path, 'ab') as f:
+        f.write(b"garbage")
+
+    acquire_kaartblad_archive("39fn2", "Tarthorst")
+    assert downloads == ["39fn2", "39fn2"]
+    # The references survive the new download
+    assert archive_store._load_index()["39fn2"]["refs"] == ["Binnenstad", "Tarthorst"]
+
+
+def test_eviction_removes_least_recently_used_unreferenced_sheets(downloads):
+    for suffix in ["39fn1", "39fn2", "39fz1", "39fz2"]:
+        acquire_kaartblad_archive(suffix, f"neighborhood_{suffix}")
+        time.sleep(0.01)
+    for suffix in ["39fn1", "39fn2", "39fz1"]:
+        release_kaartblad_archives(f"neighborhood_{suffix}")
+
+    # 39fz2 is still referenced, so only unreferenced sheets go, oldest first
+    assert evict_kaartblad_archives(max_bytes=2 * SHEET_BYTES) == ["39fn1", "39fn2"]
+    assert sorted(archive_store._load_index()) == ["39fz1", "39fz2"]
+    assert not os.path.exists(f"{KAARTBLAD_STORE_DIR}/39fn1_2020_hoogtestatistieken_gebouwen.gpkg")
+
+    assert evict_kaartblad_archives(max_bytes=0) == ["39fz1"]
+    assert sorted(archive_store._load_index()) == ["39fz2"]
+
+
+def test_eviction_skips_sheets_that_are_being_acquired(downloads):
+    acquire_kaartblad_archive("39fn2", "Binnenstad")
+    release_kaartblad_archives("Binnenstad")
+
+    with file_lock(f"{KAARTBLAD_STORE_DIR}/39fn2.lock"):
+        assert evict_kaartblad_archives(max_bytes=0) == []
+    assert evict_kaartblad_archives(max_bytes=0) == ["39fn2"]
+
+
+def test_sheet_removed_between_check_and_reference_is_downloaded_again(downloads, monkeypatch):
+    acquire_kaartblad_archive("39fn2", "Binnenstad")
+    release_kaartblad_archives("Binnenstad")
+
+    # The sheet disappears from the index right after it was judged valid
+    entry_is_valid = archive_store._entry_is_valid
+    removed = []
+
+    def remove_after_check(entry, verify):
+        valid = entry_is_valid(entry, verify)
+        if not removed:
+            removed.append(True)
+            index = archive_store._load_index()
+            os.remove(index.pop("39fn2")["gpkg"])
+            archive_store._save_index(index)
+        return valid
+
+    monkeypatch.setattr(archive_store, "_entry_is_valid", remove_after_check)
+    path = acquire_kaartblad_archive("39fn2", "Tarthorst")
+
+    assert os.path.exists(path)
+    assert downloads == ["39fn2", "39fn2"]
+    assert archive_store._load_index()["39fn2"]["refs"] == ["Tarthorst"]
@@ -0,0 +1,46 @@
+import os
+import time
+import threading
+
+from utils.file_lock import file_lock
+
+
+def test_lock_is_exclusive_between_threads(workdir):
+    counter = {"value": 0}
+
+    def increment():
+        for _ in range(25):
+            with file_lock("locks/counter.lock", poll_seconds=0.001):
+                value = counter["value"]
+                time.sleep(0.0005)
+                counter["value"] = value + 1
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter["value"] == 100
+    assert os.listdir("locks") == []
+
+
+def test_stale_lock_is_broken(workdir):
+    os.makedirs("locks")
+    with open("locks/stale.lock", "w") as f:
+        f.write("crashed-host 1\n")
+    os.utime("locks/stale.lock", (time.time() - 7200, time.time() - 7200))
+
+    with file_lock("locks/stale.lock", stale_seconds=3600) as acquired:
+        assert acquired
+    assert os.listdir("locks") == []
+
+
+def test_non_blocking_lock_gives_up_when_held(workdir):
+    with file_lock("locks/busy.lock"):
+        with file_lock("locks/busy.lock", blocking=False) as acquired:
+            assert not acquired
+        # The failed attempt must not remove the held lock
+        assert os.path.exists("locks/busy.lock")
+    with file_lock("locks/busy.lock", blocking=False) as acquired:
+        assert acquired
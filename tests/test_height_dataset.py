@@ -0,0 +1,60 @@
+import json
+
+import geopandas as gpd
+from shapely.geometry import box
+
+from utils.height_dataset import (append_building_heights, read_building_heights, read_partition_index,
+                                  list_dataset_neighborhoods, import_existing_building_heights, HEIGHT_DATASET_DIR)
+
+
+def buildings(x0, y0, n=3):
+    # n footprints of 10 x 10 m, 20 m apart, in EPSG:28992
+    return gpd.GeoDataFrame(geometry=[box(x0 + 20 * i, y0, x0 + 20 * i + 10, y0 + 10) for i in range(n)], crs="EPSG:28992")
+
+
+def bbox_4326(gdf):
+    return tuple(float(v) for v in gdf.to_crs(epsg=4326).total_bounds)
+
+
+def test_append_then_bbox_read(workdir):
+    west = buildings(170000, 440000)
+    east = buildings(180000, 440000)
+    append_building_heights(west, [10.0, None, 12.5], "Binnenstad", "Wageningen", ["39fn2"])
+    append_building_heights(east, [4.0, 5.0, 6.0], "Tarthorst", "Wageningen", ["39fn2"])
+
+    west_gdf = read_building_heights(bbox=bbox_4326(west), columns=["MeanValue"])
+    assert west_gdf["neighborhood"].unique().tolist() == ["Binnenstad"]
+    assert west_gdf["feature_id"].tolist() == [0, 1, 2]
+    assert west_gdf["MeanValue"].iloc[0] == 10.0
+    assert west_gdf["MeanValue"].isna().tolist() == [False, True, False]
+    assert west_gdf.crs.to_epsg() == 4326
+
+    assert len(read_building_heights()) == 6
+    assert len(read_building_heights(municipalities=["Ede"])) == 0
+    assert read_building_heights(neighborhoods=["Tarthorst"])["MeanValue"].tolist() == [4.0, 5.0, 6.0]
+
+
+def test_rerun_replaces_a_neighborhood(workdir):
+    append_building_heights(buildings(170000, 440000), [1.0, 2.0, 3.0], "Binnenstad", "Wageningen", ["39fn2"])
+    append_building_heights(buildings(170000, 440000, n=2), [7.0, 8.0], "Binnenstad", "Wageningen", ["39fn2"])
+
+    index = read_partition_index()
+    assert len(index) == 1
+    assert next(iter(index.values()))["rows"] == 2
+    assert read_building_heights()["MeanValue"].tolist() == [7.0, 8.0]
+
+
+def test_existing_geojson_results_are_imported_once(workdir):
+    output_dir = workdir / "output" / "estimated_building_height"
+    output_dir.mkdir(parents=True)
+    old_gdf = buildings(170000, 440000).to_crs(epsg=4326).assign(MeanValue=[3.0, None, 9.0])
+    old_gdf.to_file(output_dir / "Binnenstad.json", driver="GeoJSON")
+    manifest_dir = workdir / "data" / "manifests"
+    manifest_dir.mkdir(parents=True)
+    (manifest_dir / "Binnenstad.json").write_text(json.dumps({"municipality": ["Wageningen"], "kaartblad": ["39fn2"]}))
+
+    assert import_existing_building_heights() == ["Binnenstad"]
+    assert import_existing_building_heights() == []
+    assert list_dataset_neighborhoods() == ["Binnenstad"]
+    assert list(read_partition_index()) == ["municipality=Wageningen/kaartblad=39fn2/Binnenstad.parquet"]
+    assert (workdir / HEIGHT_DATASET_DIR / "municipality=Wageningen" / "kaartblad=39fn2" / "Binnenstad.parquet").exists()
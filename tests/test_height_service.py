@@ -0,0 +1,72 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+import geopandas as gpd
+from shapely.geometry import box
+
+from utils.height_index import BuildingHeightIndex
+from height_service import HeightRequestHandler, parse_coordinates
+
+
+@pytest.fixture
+def service(workdir):
+    """Serves two buildings and one unreadable output file on a free local port."""
+    output_dir = workdir / "output" / "estimated_building_height"
+    output_dir.mkdir(parents=True)
+    gpd.GeoDataFrame({"MeanValue": [12.0, None]}, geometry=[box(5.660, 51.960, 5.661, 51.961), box(5.662, 51.960, 5.663, 51.961)],
+                     crs="EPSG:4326").to_file(output_dir / "Binnenstad.json", driver="GeoJSON")
+    (output_dir / "Broken.json").write_text('{"type": "FeatureCol')
+
+    HeightRequestHandler.index = BuildingHeightIndex(str(output_dir))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), HeightRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def request(url, body=None):
+    data = body.encode() if isinstance(body, str) else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_parse_coordinates_checks_arity_and_numbers():
+    assert parse_coordinates([["5.66", 51.96]], 2) == [(5.66, 51.96)]
+    for values in [[[5.66]], [[5.66, 51.96, 1]], [5.66, 51.96], {"x": 1}, [[True, 1]], [["a", "b"]]]:
+        with pytest.raises(ValueError):
+            parse_coordinates(values, 2)
+
+
+def test_queries_skip_the_unreadable_file(service):
+    status, data = request(f"{service}/height?points=5.6605,51.9605;5.6625,51.9605;5.0,52.0")
+    assert status == 200
+    assert [result and result["height"] for result in data["results"]] == [12.0, None, None]
+    assert data["results"][1]["feature"] == 1
+
+    status, data = request(f"{service}/buildings", json.dumps({"bboxes": [[5.659, 51.959, 5.664, 51.962]]}))
+    assert status == 200
+    assert len(data["results"][0]) == 2
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/height?points=5.66", None),
+    ("/buildings?bbox=5.66,51.96,5.67", None),
+    ("/height?points=a,b", None),
+    ("/height", "[1, 2]"),
+    ("/height", "not json"),
+    ("/height", '{"points": [[5.66]]}'),
+    ("/buildings", '{"bboxes": [[5.66, 51.96]]}'),
+    ("/buildings", '{"bboxes": "5.66,51.96,5.67,51.97"}'),
+])
+def test_malformed_requests_get_400(service, path, body):
+    status, data = request(service + path, body)
+    assert status == 400
+    assert "error" in data
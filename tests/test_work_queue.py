@@ -0,0 +1,112 @@
+import os
+import time
+import json
+
+import pandas as pd
+
+import utils.work_queue as work_queue
+from utils.work_queue import (enqueue_jobs, claim_job, finish_job, requeue_stalled_jobs, run_worker,
+                              merge_completion_report, MAX_ATTEMPTS, QUEUE_DIR)
+
+
+def make_buurten():
+    return pd.DataFrame({
+        "gm_naam": ["Wageningen", "Wageningen", "Ede"],
+        "bu_naam": ["Binnenstad", "Tarthorst", "Centrum"],
+        "bu_code": ["BU02890000", "BU02890101", "BU02280000"]
+    })
+
+
+def jobs_in(state):
+    return sorted(file_name[:-len(".json")] for file_name in os.listdir(f"{QUEUE_DIR}/{state}") if file_name.endswith(".json"))
+
+
+def age_claim(job_id, seconds):
+    path = f"{QUEUE_DIR}/claimed/{job_id}.json"
+    os.utime(path, (time.time() - seconds, time.time() - seconds))
+
+
+def test_enqueue_skips_jobs_that_exist(workdir):
+    assert enqueue_jobs(make_buurten()) == 3
+    claim_job("worker-a")
+    assert enqueue_jobs(make_buurten()) == 0
+    assert enqueue_jobs(make_buurten(), municipalities=["Ede"]) == 0
+
+
+def test_expired_lease_requeues_stalled_job(workdir):
+    enqueue_jobs(make_buurten(), municipalities=["Ede"])
+    job = claim_job("worker-a")
+    assert jobs_in("claimed") == [job["job_id"]]
+
+    # A live lease is left alone
+    assert requeue_stalled_jobs(lease_seconds=60) == []
+
+    age_claim(job["job_id"], 120)
+    assert requeue_stalled_jobs(lease_seconds=60) == [job["job_id"]]
+    assert jobs_in("pending") == [job["job_id"]]
+
+    # The next claim counts as another attempt
+    assert claim_job("worker-b")["attempts"] == 2
+
+
+def test_fresh_claim_of_old_pending_job_keeps_its_lease(workdir):
+    enqueue_jobs(make_buurten(), municipalities=["Ede"])
+    pending_path = f"{QUEUE_DIR}/pending/{jobs_in('pending')[0]}.json"
+    os.utime(pending_path, (time.time() - 3600, time.time() - 3600))
+
+    claim_job("worker-a")
+    assert requeue_stalled_jobs(lease_seconds=60) == []
+
+
+def test_stalled_job_fails_after_retry_limit(workdir):
+    enqueue_jobs(make_buurten(), municipalities=["Ede"])
+    for attempt in range(MAX_ATTEMPTS):
+        job = claim_job(f"worker-{attempt}")
+        age_claim(job["job_id"], 120)
+        requeue_stalled_jobs(lease_seconds=60)
+
+    assert jobs_in("pending") == []
+    assert jobs_in("failed") == [job["job_id"]]
+
+
+def test_failing_job_ends_failed_after_retry_limit(workdir):
+    enqueue_jobs(make_buurten(), municipalities=["Ede"])
+    for attempt in range(MAX_ATTEMPTS):
+        job = claim_job("worker-a")
+        assert job["attempts"] == attempt + 1
+        finish_job(job, "failed", error="boom")
+
+    assert claim_job("worker-a") is None
+    assert jobs_in("claimed") == []
+    assert jobs_in("failed") == [job["job_id"]]
+
+
+def test_finish_after_lost_lease_keeps_the_new_claim(workdir):
+    enqueue_jobs(make_buurten(), municipalities=["Ede"])
+    stale_job = claim_job("worker-a")
+    age_claim(stale_job["job_id"], 120)
+    requeue_stalled_jobs(lease_seconds=60)
+    claim_job("worker-b")
+
+    # The first worker fails late; the job stays with the second worker
+    finish_job(stale_job, "failed", error="too late")
+    assert jobs_in("claimed") == [stale_job["job_id"]]
+    assert jobs_in("pending") == []
+
+
+def test_run_worker_records_why_a_job_failed(workdir, monkeypatch):
+    def failing_download_stage(*args):
+        raise LookupError("no matching kaartblad sheet for the neighborhood boundary")
+
+    monkeypatch.setattr(work_queue, "download_stage", failing_download_stage)
+    enqueue_jobs(make_buurten(), municipalities=["Ede"])
+
+    assert run_worker("worker-a", None, make_buurten(), poll_seconds=0) == 0
+    assert jobs_in("failed") == ["Ede_Centrum"]
+    with open(f"{QUEUE_DIR}/failed/Ede_Centrum.json") as f:
+        job = json.load(f)
+    assert job["attempts"] == MAX_ATTEMPTS
+    assert job["error"].startswith("LookupError: no matching kaartblad")
+
+    report = merge_completion_report()
+    assert report["failed"][0]["error"] == job["error"]
@@ -0,0 +1,62 @@
+import pytest
+import geopandas as gpd
+from rasterstats import zonal_stats
+
+from utils.label_cache import building_zonal_means, label_layers, LABEL_CACHE_DIR
+from utils.parallel_zonal import parallel_zonal_means, spatial_strips
+
+
+def assert_same_means(means, expected_means):
+    # None (no valid pixel) has to match exactly, values up to float32 rounding
+    assert len(means) == len(expected_means)
+    for i, (mean, expected) in enumerate(zip(means, expected_means)):
+        if expected is None:
+            assert mean is None, f"footprint {i}: expected no value, got {mean}"
+        else:
+            assert mean == pytest.approx(expected, rel=1e-5), f"footprint {i}"
+
+
+def rasterstats_means(footprints_gdf, chm_path):
+    return [stat["mean"] for stat in zonal_stats(footprints_gdf, chm_path, stats=["mean"])]
+
+
+def test_label_layers_separate_overlapping_footprints(overlapping_chm):
+    footprints_gdf, _ = overlapping_chm
+    layers = label_layers(footprints_gdf)
+
+    for i, j in footprints_gdf.sindex.query(footprints_gdf.geometry, predicate="intersects").T:
+        if i != j and footprints_gdf.geometry.iloc[i].overlaps(footprints_gdf.geometry.iloc[j]):
+            assert layers[i] != layers[j]
+    assert layers.max() > 0
+
+
+def test_labels_engine_matches_rasterstats_on_overlaps(overlapping_chm):
+    footprints_gdf, chm_path = overlapping_chm
+    expected = rasterstats_means(footprints_gdf, chm_path)
+
+    assert_same_means(building_zonal_means(footprints_gdf, chm_path), expected)
+    # The second run is answered from the label cache and must not change anything
+    assert_same_means(building_zonal_means(footprints_gdf, chm_path), expected)
+
+
+def test_labels_engine_cache_is_keyed_by_footprints(overlapping_chm, workdir):
+    footprints_gdf, chm_path = overlapping_chm
+    building_zonal_means(footprints_gdf, chm_path)
+
+    moved_gdf = gpd.GeoDataFrame(geometry=footprints_gdf.geometry.translate(5, 5), crs=footprints_gdf.crs)
+    assert_same_means(building_zonal_means(moved_gdf, chm_path), rasterstats_means(moved_gdf, chm_path))
+    assert len(list((workdir / LABEL_CACHE_DIR).glob("*.npz"))) == 2
+
+
+@pytest.mark.parametrize("workers", [1, 2, 3])
+def test_parallel_engine_matches_rasterstats_on_overlaps(overlapping_chm, workers):
+    footprints_gdf, chm_path = overlapping_chm
+    # With more workers the overlapping footprints end up in different strips
+    assert_same_means(parallel_zonal_means(footprints_gdf, chm_path, workers),
+                      rasterstats_means(footprints_gdf, chm_path))
+
+
+def test_spatial_strips_cover_every_footprint_once(overlapping_chm):
+    footprints_gdf, _ = overlapping_chm
+    strips = spatial_strips(footprints_gdf, 4)
+    assert sorted(i for strip in strips for i in strip) == list(range(len(footprints_gdf)))